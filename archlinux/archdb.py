@@ -0,0 +1,124 @@
+"""
+Read the package databases of the Arch Linux repositories.
+
+A repository database (core.db, extra.db, …) is a tar archive with one
+directory per package, each containing a 'desc' file. Reading these once is
+much cheaper than asking the package search for every single package.
+"""
+import sys
+import tarfile
+
+import requests
+
+dburl = "https://mirrors.kernel.org/archlinux/{repo}/os/{arch}/{repo}.db"
+
+
+def dblocations(repos, arch="x86_64"):
+    """
+    Get the download urls of the databases of the given repos.
+
+    Repos can be given in the spelling of the package search ("Core",
+    "Community-Testing").
+    """
+    return [dburl.format(repo=repo.lower(), arch=arch) for repo in repos]
+
+
+def parse_desc(fileobj):
+    """
+    Parse a 'desc' file of a repository database.
+
+    Returns a dict mapping the field names (NAME, VERSION, …) to a list of
+    the values of that field.
+    """
+    fields = {}
+    key = None
+    for line in fileobj.read().decode("utf-8", "replace").splitlines():
+        if line.startswith("%") and line.endswith("%"):
+            key = line[1:-1]
+            fields[key] = []
+        elif line == "":
+            key = None
+        elif key is not None:
+            fields[key].append(line)
+    return fields
+
+
+def getfield(fields, key):
+    values = fields.get(key)
+    if values:
+        return values[0]
+    else:
+        return ""
+
+
+def makepackage(fields, repo):
+    """
+    Convert a parsed 'desc' file in a dict with the same keys as used by the
+    results of the package search (pkgname, pkgver, url, …).
+    """
+    version, _, pkgrel = getfield(fields, "VERSION").rpartition("-")
+    epoch, _, pkgver = version.rpartition(":")
+    return {
+        "pkgname": getfield(fields, "NAME"),
+        "pkgbase": getfield(fields, "BASE"),
+        "repo": repo,
+        "arch": getfield(fields, "ARCH"),
+        "epoch": int(epoch or 0),
+        "pkgver": pkgver,
+        "pkgrel": pkgrel,
+        "pkgdesc": getfield(fields, "DESC"),
+        "url": getfield(fields, "URL"),
+    }
+
+
+def read_db(fileobj, repo=""):
+    """
+    Read the packages of a repository database from a (not seekable) stream.
+    """
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith("/desc"):
+                continue
+            yield makepackage(parse_desc(tar.extractfile(member)), repo)
+
+
+def reponame(location):
+    return location.rsplit("/", 1)[-1].split(".")[0]
+
+
+def load_db(location, session=requests):
+    """
+    Read the packages of a repository database, either from a url or a
+    local file.
+    """
+    repo = reponame(location)
+    if "://" not in location:
+        with open(location, "rb") as f:
+            yield from read_db(f, repo)
+        return
+    r = session.get(location, stream=True)
+    if r.status_code == 404:
+        r.close()
+        raise FileNotFoundError("No repository database at %s" % location)
+    r.raise_for_status()
+    r.raw.decode_content = True
+    with r:
+        yield from read_db(r.raw, repo)
+
+
+def build_index(locations, session=requests):
+    """
+    Build an index package name → package from the given databases.
+
+    If a package is contained in more than one database, the one listed first
+    wins. Missing databases – e.g. of repositories merged into others – are
+    skipped with a warning on stderr.
+    """
+    index = {}
+    for location in locations:
+        try:
+            for package in load_db(location, session):
+                index.setdefault(package["pkgname"], package)
+        except FileNotFoundError as e:
+            print("WARNING:", e, file=sys.stderr)
+    return index
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Benchmark the stages of checkversion.py without network access.
+
+Synthetic catalogs of Wikidata items and Arch packages are generated and the
+recorded responses are replayed by a local HTTP server, that stands in for
+the Wikidata Query Service, the Arch package search and the Arch mirror.
+Every stage is timed for every catalog size and the results are printed as
+one JSON object per line.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import archdb
+import checkversion
+from common import sparql
+from common.httpcache import HTTPCache
+from common.metrics import Metrics
+
+
+def makecatalog(size):
+    """
+    Generate items with a Wikidata version and an Arch version (None if the
+    package doesn't exist), with a mix of current, outdated, newer and
+    orphaned items.
+    """
+    catalog = []
+    for i in range(size):
+        wdversion = "%i.%i.%i" % (i % 7, i % 5, i % 3)
+        kind = i % 20
+        if kind < 12:
+            archversion = wdversion
+        elif kind < 15:
+            archversion = "%i.%i.%i" % (i % 7, i % 5, i % 3 + 1)
+        elif kind < 17:
+            archversion = "%i.0" % (i % 7 + 1)
+        elif kind < 19:
+            archversion = None
+        else:
+            archversion = "%i.%i" % (i % 7, i % 5)
+        catalog.append(("Q%i" % (i + 1), "pkg%i" % i, wdversion, archversion))
+    return catalog
+
+
+def literal(value):
+    return {"type": "literal", "value": value}
+
+
+def sparqlresponse(catalog):
+    bindings = []
+    for i, (qid, pkgname, wdversion, _) in enumerate(catalog):
+        binding = {
+            "item": {"type": "uri", "value": "http://www.wikidata.org/entity/" + qid},
+            "archlabel": literal(pkgname),
+            "vers": literal(wdversion),
+            "best": literal("true"),
+            "beta": literal("false"),
+        }
+        if i % 4 == 0:
+            binding["github"] = literal("https://github.com/%s/%s" % (pkgname, pkgname))
+        bindings.append(binding)
+    return json.dumps({"head": {}, "results": {"bindings": bindings}}).encode()
+
+
+def countresponse(count):
+    result = {"results": {"bindings": [{"count": literal(str(count))}]}}
+    return json.dumps(result).encode()
+
+
+def package(pkgname, pkgver):
+    return {
+        "pkgname": pkgname,
+        "pkgbase": pkgname,
+        "repo": "core",
+        "arch": "x86_64",
+        "epoch": 0,
+        "pkgver": pkgver,
+        "pkgrel": "1",
+        "pkgdesc": "Package " + pkgname,
+        "url": "https://example.org/" + pkgname,
+    }
+
+
+def searchresponse(pkgname, pkgver):
+    results = [] if pkgver is None else [package(pkgname, pkgver)]
+    return json.dumps({"results": results}).encode()
+
+
+def dbresponse(catalog):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for _, pkgname, _, archversion in catalog:
+            if archversion is None:
+                continue
+            desc = "%%NAME%%\n%s\n\n%%VERSION%%\n%s-1\n\n%%URL%%\n%s\n\n" % (
+                pkgname,
+                archversion,
+                "https://example.org/" + pkgname,
+            )
+            data = desc.encode()
+            info = tarfile.TarInfo("%s-%s-1/desc" % (pkgname, archversion))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def emptydb():
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz"):
+        pass
+    return buf.getvalue()
+
+
+class Recording:
+    """
+    The responses of all endpoints for one catalog.
+    """
+
+    def __init__(self, catalog):
+        self.sparql = sparqlresponse(catalog)
+        self.count = countresponse(len(catalog))
+        self.search = {
+            pkgname: searchresponse(pkgname, archversion)
+            for _, pkgname, _, archversion in catalog
+        }
+        self.db = dbresponse(catalog)
+        self.emptydb = emptydb()
+
+    def respond(self, path):
+        url = urllib.parse.urlsplit(path)
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == "/sparql":
+            if "COUNT" in params["query"][0]:
+                return self.count
+            return self.sparql
+        elif url.path == "/search":
+            return self.search.get(params["name"][0])
+        elif url.path == "/db/core.db":
+            return self.db
+        elif url.path.startswith("/db/"):
+            return self.emptydb
+        return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.recording.respond(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def startserver():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def setup(baseurl, cachefile):
+    """
+    Point checkversion at the stub server and at a cache of its own, with
+    fresh request metrics.
+    """
+    checkversion.archurl = baseurl + "/search?name={}"
+    checkversion.archcache = HTTPCache(cachefile, 3600, checkversion.archconn)
+    checkversion.archindex = None
+    archdb.dburl = baseurl + "/db/{repo}.db"
+    sparql.default = sparql.Client(baseurl + "/sparql")
+    checkversion.metrics = Metrics()
+    checkversion.archconn.hooks["response"] = [checkversion.metrics.hook]
+    sparql.default.session.hooks["response"].append(checkversion.metrics.hook)
+
+
+class Timer:
+    def __init__(self, size, output):
+        self.size = size
+        self.output = output
+        self.stages = {}
+
+    def __call__(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        self.stages[stage] = seconds
+        record = {"size": self.size, "stage": stage, "seconds": round(seconds, 6)}
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+        return result
+
+
+def benchmark(size, server, output, search=True):
+    catalog = makecatalog(size)
+    server.recording = Recording(catalog)
+    baseurl = "http://127.0.0.1:%i" % server.server_address[1]
+    timer = Timer(size, output)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        setup(baseurl, os.path.join(tmpdir, "archcache.sqlite"))
+
+        wdlist, wdlist_beta, githublist, statistics = timer(
+            "sparql", checkversion.fetchwikidata
+        )
+        versionlist, betaversionlist, names = timer(
+            "parse", checkversion.parsewikidata, wdlist, wdlist_beta
+        )
+        pkgnames = [names[qid] for qid in versionlist]
+
+        def lookup():
+            return list(checkversion.lookup(pkgnames))
+
+        if search:
+            timer("lookup-cold", lookup)
+            timer("lookup-warm", lookup)
+        checkversion.archindex = timer(
+            "archdb",
+            archdb.build_index,
+            archdb.dblocations(checkversion.repos),
+            checkversion.archconn,
+        )
+        archversionstrs = timer("lookup-db", lookup)
+
+        def classify():
+            state, orphanlist, outdatedlist = checkversion.checkall(
+                versionlist, betaversionlist, archversionstrs, {}
+            )
+            archversions = {
+                qid: checkversion.Software(state[qid]["arch"]) for qid in outdatedlist
+            }
+            outdatedlist, lvllist = checkversion.sortoutdated(
+                outdatedlist, archversions, versionlist
+            )
+            return orphanlist, outdatedlist, lvllist, archversions
+
+        orphanlist, outdatedlist, lvllist, archversions = timer("classify", classify)
+
+        cache = checkversion.archcache
+        report = {
+            "orphanlist": orphanlist,
+            "outdatedlist": outdatedlist,
+            "lvllist": lvllist,
+            "names": names,
+            "versionlist": versionlist,
+            "betaversionlist": betaversionlist,
+            "archversions": archversions,
+            "githublist": githublist,
+            "statistics": dict(
+                statistics,
+                outdated=len(outdatedlist),
+                newer=0,
+                cachemiss=cache.stats["miss"] + cache.stats["expired"],
+                cache=dict(cache.stats),
+                stages=dict(timer.stages),
+                http=checkversion.metrics.http(),
+            ),
+            "laststate": {},
+            "deltalist": {},
+            "date": "",
+            "cachetime": checkversion.cachetime,
+            "page": 1,
+            "pages": 1,
+        }
+        with open(os.devnull, "w") as devnull:
+            timer("render", checkversion.writehtml, devnull, report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000,100000",
+        help="comma separated list of catalog sizes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-search",
+        action="store_true",
+        help="skip the lookups with the package search",
+    )
+    parser.add_argument("--output", help="write the results to this file")
+    args = parser.parse_args()
+
+    output = sys.stdout if args.output is None else open(args.output, "w")
+    server = startserver()
+    for size in map(int, args.sizes.split(",")):
+        benchmark(size, server, output, not args.no_search)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
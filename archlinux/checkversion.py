@@ -1,25 +1,31 @@
 #!/usr/bin/env python3
 import collections
+import csv
+import json
 import os
 import re
-import subprocess
 import sys
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from glob import glob
 from itertools import zip_longest
 
 import requests
 from jinja2 import Environment, FileSystemLoader
-from joblib import Memory
 from packaging.version import parse
 from tqdm import tqdm
 
+import archdb
+
 abspath = os.path.abspath(__file__)
 dname = os.path.dirname(abspath)
-os.chdir(dname)
+sys.path.append(os.path.dirname(dname))
+from common import sparql  # noqa: E402
+from common.httpcache import HTTPCache  # noqa: E402
+from common.metrics import Metrics  # noqa: E402
+from common.ratelimit import RateLimiter  # noqa: E402
 
-file_loader = FileSystemLoader(".")
+file_loader = FileSystemLoader(dname)
 env = Environment(loader=file_loader)
 template = env.get_template("versioncomparing.html.jinja")
 
@@ -27,6 +33,12 @@ template = env.get_template("versioncomparing.html.jinja")
 archurl = "https://www.archlinux.org/packages/search/json/?name={}"
 archconn = requests.Session()
 
+# Number of parallel lookups against the package search and the maximal
+# number of requests per second sent to archlinux.org
+workers = 8
+ratelimit = RateLimiter(10)
+archconn.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=workers))
+
 # List of repos in which we want to search
 repos = [
     "Community",
@@ -39,7 +51,30 @@ repos = [
 ]
 for repo in repos:
     archurl += "&repo={}".format(repo)
-wdqurl = "https://query.wikidata.org/sparql?format=json&query="
+
+# Read the versions from the repository databases – a few downloads per run
+# instead of one search request per package
+usedb = True
+archindex = None
+
+# The results of the last run are stored here, so that only changed items
+# have to be classified again and changes since the last run can be shown
+statefile = dname + "/checkversion-state.json"
+
+# Format of the report: "html", "json" or "csv"
+outputformat = "html"
+# If set, the html report is split into pages with this number of table rows,
+# which are written to outputdir instead of stdout
+pagesize = None
+outputdir = dname + "/report"
+
+# Timings of the run and of all requests, shown in the report and written to
+# promfile for the textfile collector of the Prometheus node exporter
+metrics = Metrics()
+promfile = None
+archconn.hooks["response"].append(metrics.hook)
+sparql.default.session.hooks["response"].append(metrics.hook)
+
 query = """
 SELECT ?item ?itemLabel ?archlabel ?vers
 WHERE
@@ -97,15 +132,69 @@ querygithub = """
 }
 """
 
+# Get the data of query, betaquery and querygithub with only one query, the
+# counts of queryNumberArchLinks and queryNumberVersions are calculated from
+# its result
+combinedfetch = True
+combinedquery = """
+SELECT ?item ?archlabel ?vers ?best ?beta ?github
+WHERE
+{
+  ?item wdt:P3454 ?archlabel.
+  OPTIONAL {
+    ?item p:P348 ?v.
+    ?v ps:P348 ?vers.
+    BIND(EXISTS { ?v a wikibase:BestRank. } AS ?best)
+    BIND(EXISTS {
+      ?v pq:P548 ?q.
+      FILTER NOT EXISTS { ?v pq:P548 wd:Q2804309. }
+    } AS ?beta)
+  }
+  OPTIONAL {
+    ?item wdt:P1324 ?github.
+    FILTER contains( STR(?github), "github")
+  }
+} order by ?item
+"""
+
+
+nondigits = re.compile("[^0-9.]")
+
 
 class Software:
+    """
+    A version number, parsed once on creation.
+    """
+
+    __slots__ = ("originalstr", "versionstr", "parsed", "numbers")
+
     def __init__(self, versionstr, fuzzy=False):
         self.originalstr = versionstr
-        self.fuzzy = fuzzy
         self.versionstr = versionstr.replace("-", ".").replace(" patch ", ".")
         if fuzzy and len(self.versionstr.split(".")) > 1:
             self.versionstr = " ".join(self.versionstr.split(".")[0:-1])
         self.parsed = parse(self.versionstr)
+        # The numeric components, used to calculate differences of versions
+        self.numbers = tuple(
+            sint(n) for n in nondigits.sub("", self.versionstr).split(".")
+        )
+
+    @classmethod
+    def fromlist(cls, versionstrs, fuzzy=False):
+        """
+        Create the version objects for a list of strings.
+
+        Every distinct string is only parsed once, equal strings get the same
+        object.
+        """
+        versions = {}
+        result = []
+        for versionstr in versionstrs:
+            version = versions.get(versionstr)
+            if version is None:
+                version = versions[versionstr] = cls(versionstr, fuzzy)
+            result.append(version)
+        return result
 
     def __str__(self):
         return self.originalstr
@@ -113,7 +202,7 @@ class Software:
     def __lt__(self, other):
         return self.parsed < other.parsed
 
-    def ___le__(self, other):
+    def __le__(self, other):
         return self.parsed <= other.parsed
 
     def __eq__(self, other):
@@ -142,9 +231,7 @@ class Software:
 
         Software(4.1.5) - Software(2.0.1) = [2, 1,4]
         """
-        old = re.sub("[^0-9.]", "", self.versionstr).split(".")
-        new = re.sub("[^0-9.]", "", other.versionstr).split(".")
-        return [sint(o) - sint(n) for o, n in zip_longest(old, new, fillvalue=0)]
+        return [o - n for o, n in zip_longest(self.numbers, other.numbers, fillvalue=0)]
 
 
 class MaxDict(collections.UserDict):
@@ -152,7 +239,7 @@ class MaxDict(collections.UserDict):
         if key in self.data:
             self.data[key] = max(value, self.data[key])
         else:
-            self.data[key] = wdversion
+            self.data[key] = value
 
 
 def sint(value):
@@ -177,159 +264,402 @@ greylist = [
 
 
 # Set up cache so we don't query the arch database every time
-# delete cached values if they are older than a certain time
+# cached values expire after a certain time (in minutes) and are then
+# revalidated. The cache is opened by main(), so importing this module (as
+# benchmark.py does) doesn't touch it
 cachetime = 180
-cachemisscounter = 0
-directory = dname + "/archcache"
-if not os.path.exists(directory):
-    os.makedirs(directory)
-subprocess.call(
-    ["touch"]
-    + glob(directory)
-    + glob(directory + "/joblib/")
-    + glob(directory + "/joblib/*")
-    + glob(directory + "/joblib/*/*/")
-)
-subprocess.Popen(
-    (
-        "find",
-        directory,
-        "-type",
-        "d",
-        "-mmin",
-        "+" + str(cachetime),
-        "-exec",
-        "rm",
-        "-r",
-        "{}",
-        ";",
-    )
-).wait()
-
-memory = Memory(cachedir=directory, verbose=0)
-
-
-# Run a query against a web-api
-def runquery(url, session=requests):
-    r = session.get(url)
-    if r.status_code == 200:
-        return r.json()["results"]
-    else:
-        return None
+cachefile = dname + "/archcache.sqlite"
+archcache = None
 
 
 # Run a Spaql-Query
 def runSPARQLquery(query):
-    res = runquery(wdqurl + urllib.parse.quote_plus(query))["bindings"]
-    return [{k: v["value"] for (k, v) in r.items()} for r in res]
+    return list(sparql.values(query))
 
 
 def getSPARQLcountvalue(query):
     return int(runSPARQLquery(query)[0]["count"])
 
 
-@memory.cache
-def runarchquery(software):
-    global cachemisscounter
-    cachemisscounter += 1
-    searchres = runquery(archurl.format(urllib.parse.quote_plus(software)), archconn)
+def fetchcombined():
+    """
+    Run the combined query and split its result.
+
+    Returns the results of query and betaquery, the github-links and the
+    number of items with Arch-package and with version (as in statistics).
+    """
+    wdlist = []
+    wdlist_beta = []
+    githublist = {}
+    architems = set()
+    versionitems = set()
+    for software in runSPARQLquery(combinedquery):
+        qid = software["item"][31:]
+        architems.add(qid)
+        if software.get("best") == "true":
+            wdlist.append(software)
+            versionitems.add(qid)
+        if software.get("beta") == "true":
+            wdlist_beta.append(software)
+        if "github" in software:
+            githublist[qid] = software["github"]
+    counts = {"arch": len(architems), "version": len(versionitems)}
+    return wdlist, wdlist_beta, githublist, counts
+
+
+def searcharch(software):
+    r = archcache.get(
+        archurl.format(urllib.parse.quote_plus(software)), cacheable=(200,)
+    )
+    if r.status_code != 200:
+        raise LookupError("Package search failed: %s" % r.status_code)
+    searchres = json.loads(r.text)["results"]
     if searchres == []:
         return None
     return searchres[0]["pkgver"].split("+")[0]
 
 
-def auto_tqdm(iterlist):
-    if sys.stderr.isatty():
-        return tqdm(iterlist)
+def runarchquery(software):
+    if archindex is None:
+        return searcharch(software)
+    package = archindex.get(software)
+    if package is None:
+        return None
+    return package["pkgver"].split("+")[0]
+
+
+def lookup(softwarenames):
+    """
+    Get the Arch versions of all given packages, in the same order.
+
+    Searches for the packages are sent in parallel.
+    """
+    if archindex is not None:
+        return map(runarchquery, softwarenames)
+    executor = ThreadPoolExecutor(workers)
+    results = executor.map(runarchquery, softwarenames)
+    executor.shutdown(wait=False)
+    return results
+
+
+def fetchwikidata():
+    """
+    Get the versions, beta versions and github-links from Wikidata.
+
+    Returns the results of query and betaquery, the github-links and the
+    statistics about the items.
+    """
+    # Things that don't depend on the other queries are fetched meanwhile
+    prefetch = ThreadPoolExecutor(1)
+    linuxcount = prefetch.submit(getSPARQLcountvalue, queryNumberLinuxItems)
+    statistics = {}
+    if combinedfetch:
+        wdlist, wdlist_beta, githublist, counts = fetchcombined()
+        statistics.update(counts)
     else:
-        return iterlist
+        statistics["arch"] = getSPARQLcountvalue(queryNumberArchLinks)
+        statistics["version"] = getSPARQLcountvalue(queryNumberVersions)
+        wdlist = runSPARQLquery(query)
+        wdlist_beta = runSPARQLquery(betaquery)
+        githublist = {}
+        for software in runSPARQLquery(querygithub):
+            githublist[software["item"][31:]] = software["github"]
+    statistics["linux"] = linuxcount.result()
+    prefetch.shutdown()
+    return wdlist, wdlist_beta, githublist, statistics
+
+
+def parsewikidata(wdlist, wdlist_beta):
+    """
+    Get the newest version and the newest beta version of every item.
+
+    Returns the versions and beta versions by QID and the names of the
+    Arch packages.
+    """
+    wdversions = Software.fromlist(software["vers"] for software in wdlist)
+    versionlist = MaxDict()
+    names = {}
+    for software, wdversion in zip(wdlist, wdversions):
+        qid = software["item"][31:]
+        name = software["archlabel"]
+        if qid in blacklist:
+            continue
+        if qid in greylist:
+            wdversion = Software(software["vers"], True)
+        versionlist[qid] = wdversion
+        names[qid] = name
+
+    wdversions = Software.fromlist(software["vers"] for software in wdlist_beta)
+    betaversionlist = MaxDict()
+    for software, wdversion in zip(wdlist_beta, wdversions):
+        qid = software["item"][31:]
+        if qid in blacklist:
+            continue
+        betaversionlist[qid] = wdversion
+    return versionlist, betaversionlist, names
 
 
-# get statistics
-statistics = {}
-statistics["arch"] = getSPARQLcountvalue(queryNumberArchLinks)
-statistics["version"] = getSPARQLcountvalue(queryNumberVersions)
-statistics["linux"] = getSPARQLcountvalue(queryNumberLinuxItems)
-statistics["outdated"] = 0
-statistics["newer"] = 0
-
-# Get newest version numbers from Wikidata
-wdlist = runSPARQLquery(query)
-versionlist = MaxDict()
-names = {}
-for software in wdlist:
-    qid = software["item"][31:]
-    name = software["archlabel"]
-    wdversionstr = software["vers"]
-    if qid in blacklist:
-        continue
-    wdversion = Software(wdversionstr, qid in greylist)
-    versionlist[qid] = wdversion
-    names[qid] = name
-
-wdlist_beta = runSPARQLquery(betaquery)
-betaversionlist = MaxDict()
-for software in wdlist_beta:
-    qid = software["item"][31:]
-    name = software["archlabel"]
-    wdversionstr = software["vers"]
-    if qid in blacklist:
-        continue
-    wdversion = Software(wdversionstr)
-    betaversionlist[qid] = wdversion
-
-# Get Github-links from Wikidatas
-wdgithublist = runSPARQLquery(querygithub)
-githublist = {}
-for software in wdgithublist:
-    qid = software["item"][31:]
-    github = software["github"]
-    githublist[qid] = github
-
-# Check every software against the Arch repos
-outdatedlist = []
-archversions = {}
-orphanlist = []
-for qid in auto_tqdm(versionlist):
-    name = names[qid]
-    wdversion = versionlist[qid]
-    betaversion = betaversionlist.get(qid, "")
-    archversion_str = runarchquery(name)
+def classify(archversion_str, wdversion, betaversion, fuzzy=False):
+    """
+    Compare the Arch version of an item with the versions on Wikidata.
+
+    Returns one of "orphan", "prerelease", "outdated", "newer" or "current".
+    """
     if archversion_str is None:
-        orphanlist.append(qid)
+        return "orphan"
+    archversion = Software(archversion_str, fuzzy)
+    # Skip release-candidates, betas, etc
+    if archversion.is_prerelease():
+        return "prerelease"
+    if archversion > wdversion and archversion != betaversion:
+        return "outdated"
+    elif archversion < wdversion:
+        return "newer"
     else:
-        archversion = Software(archversion_str, qid in greylist)
-        archversions[qid] = archversion
-        # Skip release-candidates, betas, etc
-        if archversion.is_prerelease():
-            continue
-        if archversion > wdversion and archversion != betaversion:
+        return "current"
+
+
+def checkall(versionlist, betaversionlist, archversionstrs, laststate):
+    """
+    Classify every item, given the Arch versions in the order of versionlist.
+
+    Items whose versions didn't change since the last run keep their
+    classification from laststate. Returns the new state and the lists of
+    orphans and outdated items.
+    """
+    state = {}
+    orphanlist = []
+    outdatedlist = []
+    for qid, archversion_str in zip(versionlist, archversionstrs):
+        entry = {
+            "wd": str(versionlist[qid]),
+            "beta": str(betaversionlist.get(qid, "")),
+            "arch": archversion_str,
+        }
+        # Only compare the versions again if one of them changed
+        last = laststate.get(qid)
+        if last is not None and all(last[key] == entry[key] for key in entry):
+            entry["class"] = last["class"]
+        else:
+            entry["class"] = classify(
+                archversion_str,
+                versionlist[qid],
+                betaversionlist.get(qid, ""),
+                qid in greylist,
+            )
+        state[qid] = entry
+        if entry["class"] == "orphan":
+            orphanlist.append(qid)
+        elif entry["class"] == "outdated":
             outdatedlist.append(qid)
-            statistics["outdated"] += 1
-        elif archversion < wdversion:
-            statistics["newer"] += 1
+    return state, orphanlist, outdatedlist
+
+
+def getdeltalist(laststate, state):
+    """
+    Get the items that are newly outdated, fixed or orphaned since the last
+    run.
+    """
+    deltalist = {"outdated": [], "fixed": [], "orphan": []}
+    if not laststate:
+        return deltalist
+    for qid, entry in state.items():
+        lastclass = laststate.get(qid, {}).get("class")
+        if entry["class"] == lastclass:
+            continue
+        if entry["class"] in ("outdated", "orphan"):
+            deltalist[entry["class"]].append(qid)
+        elif lastclass == "outdated":
+            deltalist["fixed"].append(qid)
+    return deltalist
+
+
+def sortoutdated(outdatedlist, archversions, versionlist):
+    """
+    Sort the outdated items, bigger steps in the version number first, and
+    classify the steps as major, minor or bug.
+    """
+    deltas = {qid: archversions[qid] - versionlist[qid] for qid in outdatedlist}
+    outdatedlist = sorted(outdatedlist, key=deltas.get, reverse=True)
+
+    lvllist = {}
+    for qid in outdatedlist:
+        delta = deltas[qid]
+        if delta[0] != 0:
+            lvllist[qid] = "major"
+        elif len(delta) > 1 and delta[1] != 0:
+            lvllist[qid] = "minor"
+        else:
+            lvllist[qid] = "bug"
+    return outdatedlist, lvllist
 
 
-def getdelta(qid):
-    return archversions[qid] - versionlist[qid]
+def loadstate(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def savestate(filename, state):
+    with open(filename + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(filename + ".tmp", filename)
+
+
+def reportrows(report):
+    """
+    Yield the rows of the report – the orphans first, then the outdated
+    items.
+    """
+    for qid in report["orphanlist"] + report["outdatedlist"]:
+        yield {
+            "qid": qid,
+            "name": report["names"][qid],
+            "level": report["lvllist"].get(qid, "orphan"),
+            "arch": str(report["archversions"].get(qid, "")),
+            "wikidata": str(report["versionlist"][qid]),
+            "beta": str(report["betaversionlist"].get(qid, "")),
+            "github": report["githublist"].get(qid, ""),
+        }
+
+
+def writejson(out, rows):
+    out.write("[")
+    separator = "\n"
+    for row in rows:
+        out.write(separator)
+        json.dump(row, out)
+        separator = ",\n"
+    out.write("\n]\n")
+
+
+def writecsv(out, rows):
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(out, list(row))
+            writer.writeheader()
+        writer.writerow(row)
+
+
+def writehtml(out, context):
+    for chunk in template.generate(context):
+        out.write(chunk)
+
+
+def writepages(directory, report):
+    """
+    Write the html report split into pages of pagesize table rows.
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    orphanlist = report["orphanlist"]
+    outdatedlist = report["outdatedlist"]
+    rows = orphanlist + outdatedlist
+    pages = max(1, (len(rows) + pagesize - 1) // pagesize)
+    for page in range(1, pages + 1):
+        start = (page - 1) * pagesize
+        end = page * pagesize
+        pagecontext = dict(
+            report,
+            orphanlist=orphanlist[start:end],
+            outdatedlist=outdatedlist[
+                max(0, start - len(orphanlist)) : max(0, end - len(orphanlist))
+            ],
+            page=page,
+            pages=pages,
+        )
+        with open(os.path.join(directory, "page-%i.html" % page), "w") as f:
+            writehtml(f, pagecontext)
+
+
+def auto_tqdm(iterlist, total=None):
+    if sys.stderr.isatty():
+        return tqdm(iterlist, total=total)
+    else:
+        return iterlist
 
 
-# Sort (bigger steps in Versionsnummer fist)
-outdatedlist = sorted(outdatedlist, key=getdelta, reverse=True)
+def main():
+    global archindex, archcache
+    if archcache is None:
+        archcache = HTTPCache(cachefile, cachetime * 60, archconn, ratelimit)
+        archcache.purge(7 * 24 * 3600)
+    if usedb:
+        # The databases are downloaded while Wikidata is queried
+        prefetch = ThreadPoolExecutor(1)
+        archindexfuture = prefetch.submit(
+            archdb.build_index, archdb.dblocations(repos), archconn
+        )
+    with metrics.stage("sparql"):
+        wdlist, wdlist_beta, githublist, statistics = fetchwikidata()
+    with metrics.stage("parse"):
+        versionlist, betaversionlist, names = parsewikidata(wdlist, wdlist_beta)
+
+    # Check every software against the Arch repos
+    if usedb:
+        with metrics.stage("archdb"):
+            archindex = archindexfuture.result()
+        prefetch.shutdown()
+    with metrics.stage("lookup"):
+        laststate = loadstate(statefile)
+        archversionstrs = lookup([names[qid] for qid in versionlist])
+        state, orphanlist, outdatedlist = checkall(
+            versionlist,
+            betaversionlist,
+            auto_tqdm(archversionstrs, len(versionlist)),
+            laststate,
+        )
+        deltalist = getdeltalist(laststate, state)
+        savestate(statefile, state)
+
+    with metrics.stage("sort"):
+        archversions = {}
+        for qid in outdatedlist:
+            archversions[qid] = Software(state[qid]["arch"], qid in greylist)
+        outdatedlist, lvllist = sortoutdated(outdatedlist, archversions, versionlist)
+
+    statistics["outdated"] = len(outdatedlist)
+    statistics["newer"] = sum(entry["class"] == "newer" for entry in state.values())
+    statistics["cachemiss"] = archcache.stats["miss"] + archcache.stats["expired"]
+    statistics["cache"] = dict(archcache.stats)
+    statistics["stages"] = dict(metrics.stages)
+    statistics["http"] = metrics.http()
+
+    report = {
+        "orphanlist": orphanlist,
+        "outdatedlist": outdatedlist,
+        "lvllist": lvllist,
+        "names": names,
+        "versionlist": versionlist,
+        "betaversionlist": betaversionlist,
+        "archversions": archversions,
+        "githublist": githublist,
+        "statistics": statistics,
+        "laststate": laststate,
+        "deltalist": deltalist,
+        "date": datetime.now(),
+        "cachetime": cachetime,
+        "page": 1,
+        "pages": 1,
+    }
+
+    # print out table of outdated versions
+    with metrics.stage("render"):
+        if outputformat == "json":
+            writejson(sys.stdout, reportrows(report))
+        elif outputformat == "csv":
+            writecsv(sys.stdout, reportrows(report))
+        elif pagesize is not None:
+            writepages(outputdir, report)
+        else:
+            writehtml(sys.stdout, report)
 
-lvllist = {}
-for qid in outdatedlist:
-    delta = getdelta(qid)
-    if delta[0] != 0:
-        lvllist[qid] = "major"
-    elif len(delta) > 1 and delta[1] != 0:
-        lvllist[qid] = "minor"
-    else:
-        lvllist[qid] = "bug"
+    if promfile is not None:
+        metrics.writeprometheus(promfile, "checkversion", archcache.stats)
 
-statistics["cachemiss"] = cachemisscounter
-date = datetime.now()
 
-# print out table of outdated versions
-html = template.render(globals())
-print(html)
+if __name__ == "__main__":
+    main()
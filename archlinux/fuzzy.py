@@ -0,0 +1,108 @@
+"""
+Fuzzy search for packages by name, without asking the package search.
+
+Package names are compared by the trigrams of their normalised form, so
+'foo-bar', 'foobar' and 'python-foobar' are all found for 'Foo Bar'. Words
+of the package description count a little as well.
+"""
+import collections
+import heapq
+import re
+
+# Parts of package names that don't belong to the name of the software
+prefixes = ("python-", "python2-", "perl-", "ruby-", "nodejs-", "haskell-", "lib")
+suffixes = ("-git", "-bin", "-cli", "-qt", "-qt5", "-gtk", "-gtk2", "-gtk3")
+
+nonalnum = re.compile("[^a-z0-9]+")
+
+
+def normalize(name):
+    return nonalnum.sub("", name.lower())
+
+
+def words(text):
+    return {word for word in nonalnum.split(text.lower()) if len(word) > 2}
+
+
+def trigrams(word):
+    word = " " + word + " "
+    return {word[i : i + 3] for i in range(len(word) - 2)}
+
+
+def variants(pkgname):
+    """
+    The package name and the package name without typical prefixes and
+    suffixes, all normalised.
+    """
+    names = {pkgname.lower()}
+    for prefix in prefixes:
+        if pkgname.startswith(prefix):
+            names.add(pkgname[len(prefix) :])
+    for suffix in suffixes:
+        for name in list(names):
+            if name.endswith(suffix):
+                names.add(name[: -len(suffix)])
+    return {normalize(name) for name in names if normalize(name)}
+
+
+class TrigramIndex:
+    """
+    Index of packages by the trigrams of their names and the words of their
+    descriptions.
+    """
+
+    def __init__(self, packages, descweight=0.2):
+        self.packages = list(packages)
+        self.descweight = descweight
+        # Every name variant is a key, keys point to packages
+        self.keypackage = []
+        self.keysize = []
+        self.grams = collections.defaultdict(list)
+        self.words = collections.defaultdict(list)
+        for i, package in enumerate(self.packages):
+            for key in variants(package["pkgname"]):
+                keyid = len(self.keypackage)
+                self.keypackage.append(i)
+                grams = trigrams(key)
+                self.keysize.append(len(grams))
+                for gram in grams:
+                    self.grams[gram].append(keyid)
+            for word in words(package["pkgdesc"]):
+                self.words[word].append(i)
+
+    def search(self, label, limit=5, minscore=0.5):
+        """
+        Get the packages best matching a label as list of (score, package),
+        best first.
+
+        The score is between 0 and 1: the similarity of the names (Dice
+        coefficient of the trigrams) and, weighted with descweight, the share
+        of the words of the label found in the description.
+        """
+        querygrams = trigrams(normalize(label))
+        common = collections.Counter()
+        for gram in querygrams:
+            common.update(self.grams.get(gram, ()))
+        # Keys with fewer common trigrams can't reach minscore
+        namemin = max(0, (minscore - self.descweight) / (1 - self.descweight))
+        mincount = namemin * len(querygrams) / (2 - namemin)
+        namescores = {}
+        for keyid, count in common.items():
+            if count < mincount:
+                continue
+            dice = 2 * count / (len(querygrams) + self.keysize[keyid])
+            i = self.keypackage[keyid]
+            namescores[i] = max(namescores.get(i, 0), dice)
+
+        labelwords = words(label)
+        descmatches = collections.Counter()
+        for word in labelwords:
+            descmatches.update(self.words.get(word, ()))
+
+        scores = {}
+        for i in namescores.keys() | descmatches.keys():
+            descscore = descmatches[i] / len(labelwords) if labelwords else 0
+            namescore = namescores.get(i, 0)
+            scores[i] = (1 - self.descweight) * namescore + self.descweight * descscore
+        best = heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+        return [(score, self.packages[i]) for i, score in best if score >= minscore]
@@ -1,13 +1,26 @@
 #!/bin/env python3
+import collections
 import functools
-import urllib.parse
+import os
+import sys
 
 import pywikibot
 import requests
 from colorama import Fore, Style
 
+import archdb
+import fuzzy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import sparql  # noqa: E402
+from common.editqueue import EditQueue  # noqa: E402
+
 exactsearch = True
 doask = False
+# Match against an index of all packages of these repos instead of sending
+# one search request per item
+useindex = True
+repos = ["core", "extra", "community", "multilib"]
 
 archurl = "https://www.archlinux.org/packages/search/json/?name={}"
 archconn = requests.Session()
@@ -20,7 +33,6 @@ else:
     archurl = (
         "https://www.archlinux.org/packages/search/json/?q={}&arch=any&arch=x86_64"
     )
-wdqurl = "https://query.wikidata.org/sparql?format=json&query="
 query = """
 SELECT DISTINCT ?item ?itemLabel ?itemDescription ?website
 WHERE
@@ -78,6 +90,10 @@ def normurl(url):
     return url
 
 
+# Normalised URLs shared by all projects of KDE, see normurl
+sharedurls = {"kde.org"}
+
+
 # Ask a user a yes/no-question
 def ask(question):
     if not doask:
@@ -94,23 +110,67 @@ def getvalue(software, key):
         return ""
 
 
+def indexbyurl(index):
+    """
+    Index the packages by their normalised website.
+    """
+    byurl = collections.defaultdict(list)
+    for package in index.values():
+        if package["url"]:
+            byurl[normurl(package["url"])].append(package)
+    return byurl
+
+
+def findpackages(name, website):
+    """
+    Get the packages that could belong to an item.
+
+    With the index these are the package with the same name and the packages
+    with the same website – or the packages with the most similar names if
+    exactsearch is disabled. KDE applications are only found by their name,
+    their websites all look the same after normurl. Without the index it is
+    the result of the package search if it is unique.
+    """
+    if not useindex:
+        searchres = runquery(archurl.format(name), archconn)
+        return searchres if len(searchres) == 1 else []
+    if not exactsearch:
+        return [package for score, package in fuzzyindex.search(name)]
+    packages = []
+    if name in archindex:
+        packages.append(archindex[name])
+    if website in sharedurls:
+        return packages
+    for package in archbyurl.get(website, []):
+        if package["pkgname"] != name:
+            packages.append(package)
+    return packages
+
+
 def addPkgToItem(qid, name):
-    item = pywikibot.ItemPage(repo, qid)
     archclaim = pywikibot.Claim(repo, "P3454", datatype="external-id")
     archclaim.setTarget(name)
-    item.addClaim(archclaim, summary=u"Adding arch-package name")
+    editqueue.addclaim(qid, archclaim, "Adding arch-package name")
 
 
 site = pywikibot.Site("wikidata", "wikidata")
 repo = site.data_repository()
+editqueue = EditQueue(
+    repo, os.path.join(os.path.dirname(os.path.abspath(__file__)), "edits.jsonl")
+)
 
 print("...")
-wdlist = runquery(wdqurl + urllib.parse.quote_plus(query))
+if useindex:
+    archindex = archdb.build_index(archdb.dblocations(repos), archconn)
+    archbyurl = indexbyurl(archindex)
+    fuzzyindex = fuzzy.TrigramIndex(archindex.values())
+# Read completely, the stream would time out during the slow loop below
+wdlist = list(sparql.bindings(query))
 softwarelist = {}
 qidlist = {}
-done = []
+done = set()
 blacklist = ["python", "twine", "Q1107192", "Q28975307"]
-for software in wdlist["bindings"]:
+for software in wdlist:
     print(".", end="", flush=True)
     qid = getvalue(software, "item")[31:]
     name = getvalue(software, "itemLabel").lower()
@@ -121,13 +181,12 @@ for software in wdlist["bindings"]:
         continue
     if name in blacklist or qid in blacklist:
         continue
-    searchres = runquery(archurl.format(name), archconn)
-    if len(searchres) == 1:
-        if qid in done:
-            continue
-        pkgwebsite = normurl(searchres[0]["url"])
-        pkgname = normurl(searchres[0]["pkgname"])
-        pkgdesc = searchres[0]["pkgdesc"]
+    if qid in done:
+        continue
+    for package in findpackages(name, website):
+        pkgwebsite = normurl(package["url"])
+        pkgname = normurl(package["pkgname"])
+        pkgdesc = package["pkgdesc"]
         match = website == pkgwebsite and name == pkgname
         print("")
         print(Style.BRIGHT + "Potential Match: ", end="")
@@ -139,4 +198,6 @@ for software in wdlist["bindings"]:
         print(pkgdesc)
         if match or ask("Write?"):
             addPkgToItem(qid, pkgname)
-            done.append(qid)
+            done.add(qid)
+            break
+editqueue.flush()
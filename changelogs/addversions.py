@@ -2,6 +2,7 @@
 import csv
 import datetime
 import hashlib
+import os
 import re
 import signal
 import sys
@@ -9,8 +10,16 @@ from os.path import join
 
 import pywikibot
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..'))
+from common.editqueue import EditQueue  # noqa: E402
+from common.statements import STABLE, addversions, versionclaim  # noqa: E402
+
 site = pywikibot.Site("wikidata", "wikidata")
 repo = site.data_repository()
+# All new versions of an item are saved in one edit
+dname = os.path.dirname(os.path.abspath(__file__))
+editqueue = EditQueue(repo, os.path.join(dname, 'edits.jsonl'))
 today = datetime.date.today()
 wbtoday = pywikibot.WbTime(year=today.year, month=today.month, day=today.day)
 
@@ -77,14 +86,11 @@ with open('conf.csv', newline='') as f:
         retrieved = pywikibot.Claim(repo, 'P813')
         retrieved.setTarget(wbtoday)
 
-        # Stable Version
-        stablev = pywikibot.Claim(repo, 'P548')
-        stablev.setTarget(pywikibot.ItemPage(repo, 'Q2804309'))
-
         # Get item
         item = pywikibot.ItemPage(repo, qid)
         item.get()
 
+        claims = []
         for line in reversed(list(open(filename))):
             if doexit:
                 break
@@ -97,6 +103,8 @@ with open('conf.csv', newline='') as f:
             if 'P348' in item.claims:
                 if version in map(lambda x: x.getTarget(), item.claims['P348']):
                     continue
+            if version in map(lambda x: x.getTarget(), claims):
+                continue
             try:
                 date = datetime.datetime.strptime(datestr, dateformat).date()
             except ValueError:
@@ -104,20 +112,17 @@ with open('conf.csv', newline='') as f:
                 continue
             assert(date <= today)
             assert(date > datetime.date(1990, 1, 1))
-            print("Adding version %s (date: %s)" % (version, date))
-
-            claim = pywikibot.Claim(repo, 'P348', datatype='string')
-            claim.setTarget(version)
             assert(re.fullmatch(r'^\d+(\.\d+)*$', version))
-            item.addClaim(claim, summary=u'Adding version-number')
-
-            qualifier = pywikibot.Claim(repo, 'P577')
-            pdate = pywikibot.WbTime(date.year, date.month, date.day)
-            qualifier.setTarget(pdate)
-            claim.addQualifier(qualifier, summary='Adding a date of release.')
+            print("Adding version %s (date: %s)" % (version, date))
 
             # FIXME
-            if version[0] != '0':
-                claim.addQualifier(stablev, summary='Set stable version')
+            releasetype = STABLE if version[0] != '0' else None
+            claims.append(versionclaim(repo, version, date, releasetype,
+                                       [statedin, title, retrieved]))
+        if doexit:
+            # The file is not done, don't skip it next time
+            os.remove(filename + '.md5')
+            break
+        addversions(editqueue, item, claims, u'Adding version-numbers')
 
-            claim.addSources([statedin, title, retrieved], summary='Adding source.')
+editqueue.flush()
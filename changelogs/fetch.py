@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Download the changelogs of the projects in conf.csv and write their versions
+with date of release to versionlists/, one file per project – the input of
+addversions.py.
+
+Every project has a parser, registered with @source. The changelogs are read
+at the same time with conditional GETs, so unchanged changelogs are neither
+downloaded nor parsed again. Version lists are replaced atomically and only if
+their content changed. Projects that fail are reported at the end and make the
+exit status non-zero; their version lists are kept.
+
+    ./fetch.py              # all projects
+    ./fetch.py feh qemu     # only these
+"""
+import argparse
+import concurrent.futures
+import csv
+import html
+import json
+import os
+import re
+import sys
+
+import requests
+from urllib3.util.retry import Retry
+
+dname = os.path.dirname(os.path.abspath(__file__))
+listdir = os.path.join(dname, "versionlists")
+# Validators (ETag, Last-Modified) of the changelogs of the last run
+statefile = os.path.join(listdir, "validators.json")
+# Changelogs downloaded at the same time
+workers = 8
+
+session = requests.Session()
+session.headers["User-Agent"] = "wikidata-changelogs (+https://www.wikidata.org)"
+session.mount(
+    "https://",
+    requests.adapters.HTTPAdapter(
+        pool_maxsize=workers,
+        max_retries=Retry(
+            total=3, backoff_factor=1, status_forcelist=(500, 502, 503, 504)
+        ),
+    ),
+)
+
+# Parsers by project name: (url of the changelog, function text → versions)
+parsers = {}
+
+
+def source(name, url):
+    """
+    Register the parser of a project. It gets the text of `url` and returns
+    the (version, date) pairs in it, with the date in the format of conf.csv.
+    """
+
+    def register(func):
+        parsers[name] = (url, func)
+        return func
+
+    return register
+
+
+def striptags(text):
+    """
+    The text of an HTML page, roughly as a text browser would show it: one
+    line per row, heading or paragraph.
+    """
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"(?i)<br\s*/?>|</(tr|p|li|div|h\d)>", "\n", text)
+    return html.unescape(re.sub(r"<[^>]*>", " ", text))
+
+
+@source("feh", "https://feh.finalrewind.org/archive/")
+def feh(text):
+    versions = []
+    version = None
+    for match in re.finditer(
+        r"<h1>(?:<[^>]*>)*feh v([\d.]+)|<span class=\"date\">([^<]+)<", text
+    ):
+        if match.group(1):
+            version = match.group(1)
+        elif version is not None:
+            versions.append((version, match.group(2).strip()))
+            version = None
+    return versions
+
+
+@source("libvirt", "https://libvirt.org/news.html")
+def libvirt(text):
+    return re.findall(r"\b(\d+(?:\.\d+)+) \((\d{4}-\d{2}-\d{2})\)", text)
+
+
+@source("qcad", "https://www.qcad.org/en/changelog")
+def qcad(text):
+    return [
+        match
+        for line in text.splitlines()
+        if re.search(r"<h2>.*</h2>", line)
+        for match in re.findall(r"\b(\d(?:\.\d+)+) +\((\d{4}/\d{2}/\d{2})\)", line)
+    ]
+
+
+@source("pidgin", "https://pidgin.im/ChangeLog")
+def pidgin(text):
+    return re.findall(r"(?m)^version.*?\b(\d(?:\.\d+)+) +\((\d{2}/\d{2}/\d{4})\)", text)
+
+
+@source("weechat", "https://weechat.org/files/changelog/ChangeLog-stable.html")
+def weechat(text):
+    return re.findall(r"\b(\d+(?:\.\d+)+) +\((\d{4}-\d{2}-\d{2})\)", text)
+
+
+@source("sqlite", "https://sqlite.org/chronology.html")
+def sqlite(text):
+    versions = []
+    for line in striptags(text).splitlines():
+        match = re.match(r"\s*(\d{4}-\d{2}-\d{2})\s+(\d+(?:\.\d+)+)\s*$", line)
+        if match and (match.group(2), match.group(1)) not in versions[-1:]:
+            versions.append((match.group(2), match.group(1)))
+    return versions
+
+
+@source(
+    "clisp",
+    "https://sourceforge.net/p/clisp/clisp/ci/default/tree/src/NEWS?format=raw",
+)
+def clisp(text):
+    return re.findall(r"(?m)^(\d+(?:\.\d+)+) \((\d{4}-\d{2}-\d{2})\)$", text)
+
+
+@source("lvm2", "https://sourceware.org/pub/lvm2/WHATS_NEW")
+def lvm2(text):
+    return [
+        (version, "%s.%s.%s" % (day, month, year))
+        for version, day, month, year in re.findall(
+            r"(?m)^Version ([\d.]+) - (\d+)[a-z]{2} (\w+) (\d+)", text
+        )
+    ]
+
+
+@source("file", "https://raw.githubusercontent.com/file/file/master/ChangeLog")
+def file(text):
+    return [
+        (version, date)
+        for date, version in re.findall(
+            r"(?m)^(20\d\d-\d\d-\d\d)\b.*\n(?:.*\n)?\s*\* release (5\.\d+)", text
+        )
+    ]
+
+
+@source("qemu", "https://download.qemu.org/")
+def qemu(text):
+    versions = []
+    for line in text.splitlines():
+        version = re.search(r"\"qemu-(\d+\.\d+\.\d+)\.tar\.xz\.sig\"", line)
+        date = re.search(r"\b20\d{2}-\d{2}-\d{2}\b", line)
+        if version and date:
+            versions.append((version.group(1), date.group()))
+    return versions
+
+
+@source("mupdf", "https://mupdf.com/release_history.html")
+def mupdf(text):
+    return re.findall(r"(?m)^MuPDF (\d+(?:\.\d+)+) \((20\d\d-\d\d-\d\d)\)$", text)
+
+
+@source(
+    "vagrant", "https://raw.githubusercontent.com/hashicorp/vagrant/main/CHANGELOG.md"
+)
+def vagrant(text):
+    # ## 2.2.4 (February 27, 2019) → 2.2.4 February-27-2019
+    return [
+        (version, re.sub(r",? ", "-", date))
+        for version, date in re.findall(r"(?m)^## (\d+(?:\.\d+)+) \((.*)\)$", text)
+    ]
+
+
+@source("links", "http://links.twibright.com/download/ChangeLog")
+def links(text):
+    # === RELEASE 2.19 ===, then the date: Mon Mar 18 16:30:31 CET 2019
+    return [
+        (version, "-".join(date))
+        for version, *date in re.findall(
+            r"(?m)^=== RELEASE ([\d.]+) ===\n(?:-*\n)?"
+            r"(\S+) (\S+) +(\S+) \S+ \S+[A-Z ]*(\d{4})",
+            text,
+        )
+    ]
+
+
+@source("fossil", "https://www.fossil-scm.org/index.html/doc/trunk/www/changes.wiki")
+def fossil(text):
+    return re.findall(r"(?i)Changes For Version ([\d.]+) \((\d{4}-\d{2}-\d{2})\)", text)
+
+
+@source("poppler", "https://poppler.freedesktop.org/releases.html")
+def poppler(text):
+    # poppler-0.74.0.tar.xz</a> (Mon Feb 18, 2019) → 0.74.0 Mon_Feb_18_2019
+    return [
+        (version, date.replace(",", "").replace(" ", "_"))
+        for version, date in re.findall(
+            r"poppler-([\d.]+)\.tar\..z</a> \(([^)]*)\)", text
+        )
+    ]
+
+
+@source("babl", "https://gitlab.gnome.org/GNOME/babl/raw/master/NEWS")
+def babl(text):
+    return [
+        (version.rstrip("."), date)
+        for date, version in re.findall(r"(\d+-\d+-\d+) babl-([\d.]+)", text)
+    ]
+
+
+def readstate():
+    if not os.path.exists(statefile):
+        return {}
+    with open(statefile) as f:
+        return json.load(f)
+
+
+def writeatomic(filename, content):
+    with open(filename + ".tmp", "w") as f:
+        f.write(content)
+    os.replace(filename + ".tmp", filename)
+
+
+def fetch(name, validators):
+    """
+    Download and parse the changelog of a project. Return the version list
+    and the new validators, or None if the changelog is unchanged.
+    """
+    url, parse = parsers[name]
+    headers = {}
+    if validators.get("url") == url and os.path.exists(os.path.join(listdir, name)):
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("modified"):
+            headers["If-Modified-Since"] = validators["modified"]
+    r = session.get(url, headers=headers, timeout=60)
+    if r.status_code == 304:
+        return None
+    r.raise_for_status()
+    versions = parse(r.text)
+    if not versions:
+        raise LookupError("no versions found, did the changelog change?")
+    content = "".join("%s %s\n" % version for version in versions)
+    return content, {
+        "url": url,
+        "etag": r.headers.get("ETag"),
+        "modified": r.headers.get("Last-Modified"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("projects", nargs="*", help="only fetch these projects")
+    parser.add_argument(
+        "--force", action="store_true", help="download unchanged changelogs too"
+    )
+    args = parser.parse_args()
+
+    with open(os.path.join(dname, "conf.csv"), newline="") as f:
+        names = [row[1] for row in csv.reader(f)]
+    if args.projects:
+        names = [name for name in names if name in args.projects]
+    for name in names:
+        if name not in parsers:
+            print("%s: no parser" % name)
+    names = [name for name in names if name in parsers]
+
+    os.makedirs(listdir, exist_ok=True)
+    state = {} if args.force else readstate()
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        futures = {
+            name: pool.submit(fetch, name, state.get(name, {})) for name in names
+        }
+        for name, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                failed.append(name)
+                print("%s: FAILED – %s" % (name, e), file=sys.stderr)
+                continue
+            if result is None:
+                print("%s: unchanged" % name)
+                continue
+            content, state[name] = result
+            filename = os.path.join(listdir, name)
+            if os.path.exists(filename):
+                with open(filename) as f:
+                    old = f.read()
+            else:
+                old = None
+            if content != old:
+                writeatomic(filename, content)
+            print(
+                "%s: %i versions%s"
+                % (name, content.count("\n"), "" if content != old else ", unchanged")
+            )
+            writeatomic(statefile, json.dumps(state, indent=1))
+
+    if failed:
+        print("Failed: %s" % ", ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+"""
+Code shared by the scripts in the different folders.
+
+The scripts add the root of the repository to their search path, so that
+this package can be imported as `common`.
+"""
@@ -0,0 +1,308 @@
+"""
+Queue for edits to Wikidata.
+
+All changes to one entity are collected and saved with a single
+wbeditentity request, i.e. in one revision instead of one revision per
+claim, qualifier and source. The queue is written to a journal file, so the
+edits of an interrupted run are sent by the next run; edits that are rejected
+are moved to a failures file next to it. Alternatively changes are written to
+a changeset, to review them before they are sent.
+
+Changes are sent with the revision of the entity they are based on, so they
+can't silently overwrite edits made in the meantime.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+
+def addsources(claim, sourceclaims):
+    """
+    Add a reference to a claim without saving it – unlike claim.addSources,
+    that saves immediately if the claim belongs to an item.
+    """
+    source = collections.defaultdict(list)
+    for sourceclaim in sourceclaims:
+        sourceclaim.isReference = True
+        source[sourceclaim.getID()].append(sourceclaim)
+    claim.sources.append(source)
+
+
+def addqualifier(claim, qualifier):
+    """
+    Add a qualifier to a claim without saving it.
+    """
+    qualifier.isQualifier = True
+    claim.qualifiers.setdefault(qualifier.getID(), []).append(qualifier)
+
+
+class MaxlagThrottle:
+    """
+    Wait between edits, longer when the replication lag of the database
+    servers rises and not at all while it is above maxlag.
+
+    `getlag` returns the current lag in seconds, it is called at most every
+    `interval` seconds.
+    """
+
+    def __init__(self, getlag, maxlag=5, delay=1, interval=30):
+        self.getlag = getlag
+        self.maxlag = maxlag
+        self.delay = delay
+        self.interval = interval
+        self.lag = 0
+        self.checked = 0
+        self.last = 0
+
+    def currentlag(self):
+        if time.monotonic() - self.checked > self.interval:
+            self.lag = self.getlag()
+            self.checked = time.monotonic()
+        return self.lag
+
+    def wait(self):
+        while self.currentlag() >= self.maxlag:
+            time.sleep(self.interval)
+        delay = self.delay * (1 + 4 * self.lag / self.maxlag)
+        remaining = self.last + delay - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        self.last = time.monotonic()
+
+
+def dbrepllag(site):
+    """
+    The current replication lag of a pywikibot site.
+    """
+    request = site.simple_request(action="query", meta="siteinfo", siprop="dbrepllag")
+    return request.submit()["query"]["dbrepllag"][0]["lag"]
+
+
+class EditQueue:
+    """
+    Collect changes to entities and save all changes to an entity in one
+    revision.
+
+    Changes are sent when flush() is called or when changes for more than
+    `batchsize` entities are pending. By default the edits are sent with
+    pywikibot to `site`, pass `submit` (a function taking the entity id, the
+    data, the summary and the base revision, returning the new revision) and
+    `getlag` to send them elsewhere.
+    """
+
+    def __init__(
+        self,
+        site=None,
+        filename=None,
+        batchsize=50,
+        maxlag=5,
+        delay=1,
+        submit=None,
+        getlag=None,
+    ):
+        self.site = site
+        self.filename = filename
+        self.batchsize = batchsize
+        self.maxlag = maxlag
+        self.submit = submit or self.wbeditentity
+        if submit is None:
+            import pywikibot
+
+            # editEntity doesn't take maxlag, pywikibot sends the configured one
+            pywikibot.config.maxlag = maxlag
+        if getlag is None:
+            getlag = lambda: dbrepllag(site)  # noqa: E731
+        self.throttle = MaxlagThrottle(getlag, maxlag, delay)
+        self.pending = collections.OrderedDict()
+        # Revisions created by this queue, by entity
+        self.revisions = {}
+        self.edits = 0
+        self.failed = 0
+        if filename is not None:
+            self.load()
+
+    def load(self):
+        """
+        Read the changes that were not sent by the last run.
+        """
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename) as f:
+            for line in f:
+                entry = json.loads(line)
+                if "done" in entry:
+                    self.pending.pop(entry["done"], None)
+                else:
+                    self.queue(
+                        entry["id"],
+                        entry["claim"],
+                        entry["summary"],
+                        entry.get("baserevid"),
+                    )
+
+    def journal(self, entries):
+        if self.filename is None:
+            return
+        # One write, so an interruption doesn't leave half of the changes
+        with open(self.filename, "a") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+
+    def queue(self, qid, claimjson, summary, baserevid=None):
+        entity = self.pending.setdefault(
+            qid, {"claims": [], "summary": [], "baserevid": None}
+        )
+        if baserevid is not None:
+            # Changes to an item loaded before one of our own edits of it are
+            # based on that edit
+            baserevid = max(baserevid, self.revisions.get(qid, 0))
+            if entity["baserevid"] is None or baserevid < entity["baserevid"]:
+                entity["baserevid"] = baserevid
+        # A claim that is changed again replaces the queued version
+        if "id" in claimjson:
+            entity["claims"] = [
+                c for c in entity["claims"] if c.get("id") != claimjson["id"]
+            ]
+        entity["claims"].append(claimjson)
+        if summary not in entity["summary"]:
+            entity["summary"].append(summary)
+
+    def addclaim(self, qid, claim, summary, baserevid=None):
+        """
+        Queue a new or changed claim (with its qualifiers and sources).
+        `baserevid` is the revision of the entity the claim is based on, e.g.
+        item.latest_revision_id.
+        """
+        self.addclaims(qid, [claim], summary, baserevid)
+
+    def addclaims(self, qid, claims, summary, baserevid=None):
+        """
+        Queue several claims of an entity, that are saved in the same edit.
+        """
+        self.addjson(qid, [claim.toJSON() for claim in claims], summary, baserevid)
+
+    def addjson(self, qid, claimjsons, summary, baserevid=None):
+        for claimjson in claimjsons:
+            self.queue(qid, claimjson, summary, baserevid)
+        self.journal(
+            [
+                {
+                    "id": qid,
+                    "claim": claimjson,
+                    "summary": summary,
+                    "baserevid": baserevid,
+                }
+                for claimjson in claimjsons
+            ]
+        )
+        if len(self.pending) > self.batchsize:
+            self.flush()
+
+    def wbeditentity(self, qid, data, summary, baserevid=None):
+        kwargs = {} if baserevid is None else {"baserevid": baserevid}
+        result = self.site.editEntity(
+            {"id": qid}, data, summary=summary, bot=True, **kwargs
+        )
+        return result.get("entity", {}).get("lastrevid")
+
+    def fail(self, qid, entity, error):
+        """
+        Move the changes of an entity that were rejected to the failures file,
+        so they don't block the queue. They can be sent with apply() after
+        they were fixed.
+        """
+        self.failed += 1
+        print("Edit of %s failed: %s" % (qid, error))
+        if self.filename is None:
+            return
+        with open(self.filename + ".failed", "a") as f:
+            for claimjson in entity["claims"]:
+                entry = {
+                    "id": qid,
+                    "claim": claimjson,
+                    "summary": "; ".join(entity["summary"]),
+                    "baserevid": entity["baserevid"],
+                    "error": str(error),
+                }
+                f.write(json.dumps(entry) + "\n")
+
+    def flush(self):
+        """
+        Send all pending changes, one request per entity.
+        """
+        while self.pending:
+            qid, entity = next(iter(self.pending.items()))
+            self.throttle.wait()
+            try:
+                revision = self.submit(
+                    qid,
+                    {"claims": entity["claims"]},
+                    "; ".join(entity["summary"]),
+                    entity["baserevid"],
+                )
+            except Exception as e:
+                self.fail(qid, entity, e)
+            else:
+                self.edits += 1
+                if revision:
+                    self.revisions[qid] = revision
+            del self.pending[qid]
+            self.journal([{"done": qid}])
+        if self.filename is not None and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+class Changeset:
+    """
+    Changes planned for entities, written to a JSON lines file (in the format
+    of the journal of EditQueue) instead of being sent. The file can be
+    reviewed and edited, then the changes are sent with apply().
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "a")
+        self.lock = threading.Lock()
+
+    def addclaim(self, qid, claim, summary, baserevid=None):
+        entry = {
+            "id": qid,
+            "claim": claim.toJSON(),
+            "summary": summary,
+            "baserevid": baserevid,
+        }
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+
+def readchangeset(filename):
+    """
+    Read the changes of a changeset, without duplicates: a new claim planned
+    twice is only added once. Of changed claims the last version wins anyway.
+    """
+    seen = set()
+    with open(filename) as f:
+        for line in f:
+            entry = json.loads(line)
+            claim = entry["claim"]
+            if "id" not in claim:
+                key = (entry["id"], json.dumps(claim["mainsnak"], sort_keys=True))
+                if key in seen:
+                    continue
+                seen.add(key)
+            yield entry
+
+
+def apply(filename, editqueue):
+    """
+    Send the changes of a changeset with an edit queue.
+    """
+    for entry in readchangeset(filename):
+        editqueue.addjson(
+            entry["id"], [entry["claim"]], entry["summary"], entry.get("baserevid")
+        )
+    editqueue.flush()
@@ -0,0 +1,269 @@
+import argparse
+import collections
+import threading
+import time
+import zlib
+
+import requests
+
+from common.sqlitedb import ThreadLocalDB
+
+CachedResponse = collections.namedtuple(
+    "CachedResponse", ["status_code", "text", "fromcache"]
+)
+
+
+class HTTPCache(ThreadLocalDB):
+    """
+    Cache for GET requests, stored in a single SQLite file.
+
+    Every entry expires `ttl` seconds after it was fetched – `notfoundttl` for
+    404 responses and `errorttl` for server errors (5xx), which are not cached
+    by default. Expired entries are revalidated with a conditional GET if the
+    server sent an ETag or a Last-Modified header, so unchanged responses are
+    not downloaded again. Bodies are stored compressed; if `maxsize` (in
+    bytes) is given, the least recently used entries are removed when the
+    cache grows beyond it. The file can be used by several threads and
+    processes at the same time.
+    """
+
+    def __init__(
+        self,
+        filename,
+        ttl,
+        session=requests,
+        ratelimit=None,
+        notfoundttl=None,
+        errorttl=0,
+        maxsize=None,
+    ):
+        self.filename = filename
+        self.ttl = ttl
+        self.notfoundttl = ttl if notfoundttl is None else notfoundttl
+        self.errorttl = errorttl
+        self.maxsize = maxsize
+        self.session = session
+        self.ratelimit = ratelimit
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        self.db.execute("""CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                status INTEGER,
+                body TEXT,
+                expires REAL,
+                etag TEXT,
+                modified TEXT,
+                accessed REAL,
+                size INTEGER
+            )""")
+        # Caches created before entries were compressed and evicted
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(cache)")]
+        if "accessed" not in columns:
+            self.db.execute("ALTER TABLE cache ADD COLUMN accessed REAL DEFAULT 0")
+            self.db.execute("ALTER TABLE cache ADD COLUMN size INTEGER")
+            self.db.execute("UPDATE cache SET size = length(body)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self.size = self.db.execute("SELECT SUM(size) FROM cache").fetchone()[0] or 0
+
+    def count(self, event):
+        with self.lock:
+            self.stats[event] += 1
+
+    def ttlfor(self, status, cacheable):
+        """
+        How long a response with this status code is kept, 0 if not at all.
+        """
+        if status >= 500:
+            return self.errorttl
+        if status not in cacheable:
+            return 0
+        if status == 404:
+            return self.notfoundttl
+        return self.ttl
+
+    def fresh(self, key):
+        """
+        The response stored under `key` if it hasn't expired yet, else None –
+        to avoid preparing a request that isn't needed.
+        """
+        row = self.db.execute(
+            "SELECT status, body FROM cache WHERE key = ? AND expires > ?",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        self.count("hit")
+        self.db.execute(
+            "UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key)
+        )
+        return CachedResponse(row[0], decompress(row[1]), True)
+
+    def get(self, url, key=None, cacheable=(200, 404), parse=None):
+        """
+        Get an url, from the cache if possible.
+
+        The entry is stored under `key`, defaulting to the url – use a
+        different key if the url contains secrets like API keys. Only
+        responses with a status code in `cacheable` (and server errors, if
+        errorttl is set) are stored. If `parse` is given, the body of
+        successful responses is replaced by parse(body) before it is stored,
+        so only the needed parts are kept.
+        """
+        if key is None:
+            key = url
+        row = self.db.execute(
+            "SELECT status, body, expires, etag, modified FROM cache WHERE key = ?",
+            (key,),
+        ).fetchone()
+        headers = {}
+        if row is not None:
+            status, body, expires, etag, modified = row
+            body = decompress(body)
+            if expires > time.time():
+                self.count("hit")
+                self.db.execute(
+                    "UPDATE cache SET accessed = ? WHERE key = ?", (time.time(), key)
+                )
+                return CachedResponse(status, body, True)
+            self.count("expired")
+            if etag:
+                headers["If-None-Match"] = etag
+            if modified:
+                headers["If-Modified-Since"] = modified
+        else:
+            self.count("miss")
+
+        if self.ratelimit is not None:
+            self.ratelimit.wait(url)
+        r = self.session.get(url, headers=headers)
+        if r.status_code == 304 and row is not None:
+            self.count("revalidated")
+            self.db.execute(
+                "UPDATE cache SET expires = ?, accessed = ? WHERE key = ?",
+                (time.time() + self.ttlfor(status, cacheable), time.time(), key),
+            )
+            return CachedResponse(status, body, False)
+        text = r.text
+        if parse is not None and r.status_code == 200:
+            text = parse(text)
+        ttl = self.ttlfor(r.status_code, cacheable)
+        if ttl > 0:
+            self.store(key, r, text, ttl)
+        return CachedResponse(r.status_code, text, False)
+
+    def store(self, key, response, text, ttl):
+        data = zlib.compress(text.encode())
+        old = self.db.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+        self.db.execute(
+            "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                response.status_code,
+                data,
+                time.time() + ttl,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                time.time(),
+                len(data),
+            ),
+        )
+        oldsize = old[0] or 0 if old is not None else 0
+        with self.lock:
+            self.size += len(data) - oldsize
+            overfull = self.maxsize is not None and self.size > self.maxsize
+        if overfull:
+            self.evict(self.maxsize)
+
+    def evict(self, maxsize):
+        """
+        Remove the least recently used entries until the cache is at most 90 %
+        of maxsize, so that not every new entry causes an eviction.
+        """
+        self.size = self.db.execute("SELECT SUM(size) FROM cache").fetchone()[0] or 0
+        excess = self.size - 0.9 * maxsize
+        removed = 0
+        keys = []
+        for key, size in self.db.execute(
+            "SELECT key, size FROM cache ORDER BY accessed"
+        ):
+            if removed >= excess:
+                break
+            keys.append((key,))
+            removed += size or 0
+        self.db.executemany("DELETE FROM cache WHERE key = ?", keys)
+        with self.lock:
+            self.size -= removed
+            self.stats["evicted"] += len(keys)
+
+    def purge(self, age=0):
+        """
+        Delete all entries that expired more than `age` seconds ago.
+        """
+        self.db.execute("DELETE FROM cache WHERE expires < ?", (time.time() - age,))
+        self.size = self.db.execute("SELECT SUM(size) FROM cache").fetchone()[0] or 0
+
+    def summary(self):
+        """
+        Number and size of the entries by status code, and how many expired.
+        """
+        now = time.time()
+        return self.db.execute(
+            """SELECT status, COUNT(*), SUM(size), SUM(expires < ?)
+            FROM cache GROUP BY status ORDER BY status""",
+            (now,),
+        ).fetchall()
+
+    def compact(self, maxsize=None):
+        """
+        Remove expired entries, compress entries stored uncompressed by older
+        versions, shrink the cache to maxsize and give the space back to the
+        file system.
+        """
+        self.purge()
+        rows = self.db.execute(
+            "SELECT key, body FROM cache WHERE typeof(body) = 'text'"
+        ).fetchall()
+        for key, body in rows:
+            data = zlib.compress(body.encode())
+            self.db.execute(
+                "UPDATE cache SET body = ?, size = ? WHERE key = ?",
+                (data, len(data), key),
+            )
+        if maxsize is None:
+            maxsize = self.maxsize
+        if maxsize is not None:
+            self.evict(maxsize)
+        self.db.execute("VACUUM")
+        self.size = self.db.execute("SELECT SUM(size) FROM cache").fetchone()[0] or 0
+
+
+def decompress(body):
+    # Entries written by older versions are stored as uncompressed text
+    if isinstance(body, bytes):
+        return zlib.decompress(body).decode()
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or compact an HTTP cache.")
+    parser.add_argument("command", choices=["stats", "compact"])
+    parser.add_argument("filename", help="the SQLite file of the cache")
+    parser.add_argument(
+        "--maxsize", type=int, help="compact: shrink the cache to this many bytes"
+    )
+    args = parser.parse_args()
+
+    cache = HTTPCache(args.filename, 0)
+    if args.command == "compact":
+        cache.compact(args.maxsize)
+    total = 0
+    print("status  entries        bytes  expired")
+    for status, entries, size, expired in cache.summary():
+        print("%6i %8i %12i %8i" % (status, entries, size or 0, expired))
+        total += size or 0
+    print("total %23i" % total)
+
+
+if __name__ == "__main__":
+    main()
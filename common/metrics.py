@@ -0,0 +1,142 @@
+import collections
+import contextlib
+import os
+import threading
+import time
+import urllib.parse
+
+
+def percentile(values, p):
+    """
+    The p-th percentile (nearest rank) of a sorted list.
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+class Metrics:
+    """
+    Collect the wall time of the stages of a run and the latency and size of
+    all HTTP requests, per host.
+
+    Register `hook` as response hook of a requests session to record its
+    requests.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.latencies = collections.defaultdict(list)
+        self.bytes = collections.Counter()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - start
+
+    def addbytes(self, endpoint, count):
+        with self.lock:
+            self.bytes[endpoint] += count
+
+    def hook(self, response, *args, **kwargs):
+        endpoint = urllib.parse.urlsplit(response.url).netloc
+        with self.lock:
+            self.latencies[endpoint].append(response.elapsed.total_seconds())
+        length = response.headers.get("Content-Length")
+        if length is not None:
+            self.addbytes(endpoint, int(length))
+        elif not kwargs.get("stream"):
+            self.addbytes(endpoint, len(response.content))
+        else:
+            # Count streamed responses while they are read
+            iter_content = response.iter_content
+
+            def counting_iter_content(*args, **kwargs):
+                for chunk in iter_content(*args, **kwargs):
+                    self.addbytes(endpoint, len(chunk))
+                    yield chunk
+
+            response.iter_content = counting_iter_content
+
+    def http(self):
+        """
+        Summary of the requests per host: number, latency percentiles (in
+        seconds) and bytes received.
+        """
+        summary = {}
+        with self.lock:
+            for endpoint, latencies in self.latencies.items():
+                latencies = sorted(latencies)
+                summary[endpoint] = {
+                    "requests": len(latencies),
+                    "p50": percentile(latencies, 50),
+                    "p90": percentile(latencies, 90),
+                    "p99": percentile(latencies, 99),
+                    "bytes": self.bytes[endpoint],
+                }
+        return summary
+
+    def prometheus(self, prefix, cachestats=None):
+        """
+        Format the metrics for the textfile collector of the Prometheus node
+        exporter.
+        """
+        lines = []
+
+        def metric(name, kind, helptext, samples):
+            lines.append("# HELP {}_{} {}".format(prefix, name, helptext))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+            for labels, value in samples:
+                labelstr = ",".join('{}="{}"'.format(k, v) for k, v in labels)
+                lines.append("{}_{}{{{}}} {}".format(prefix, name, labelstr, value))
+
+        http = self.http()
+        metric(
+            "stage_seconds",
+            "gauge",
+            "Wall time of the stages of the last run.",
+            [((("stage", stage),), seconds) for stage, seconds in self.stages.items()],
+        )
+        metric(
+            "http_request_seconds",
+            "gauge",
+            "Latency percentiles of the HTTP requests of the last run.",
+            [
+                ((("endpoint", endpoint), ("quantile", q / 100)), values["p%i" % q])
+                for endpoint, values in http.items()
+                for q in (50, 90, 99)
+            ],
+        )
+        metric(
+            "http_requests",
+            "gauge",
+            "Number of HTTP requests of the last run.",
+            [((("endpoint", e),), values["requests"]) for e, values in http.items()],
+        )
+        metric(
+            "http_bytes",
+            "gauge",
+            "Bytes received in the last run.",
+            [((("endpoint", e),), values["bytes"]) for e, values in http.items()],
+        )
+        if cachestats is not None:
+            metric(
+                "cache_events",
+                "gauge",
+                "Cache hits, misses and expired entries of the last run.",
+                [((("event", event),), count) for event, count in cachestats.items()],
+            )
+        return "\n".join(lines) + "\n"
+
+    def writeprometheus(self, filename, prefix, cachestats=None):
+        """
+        Write the metrics to a file, atomically so that the node exporter never
+        reads an incomplete file.
+        """
+        with open(filename + ".tmp", "w") as f:
+            f.write(self.prometheus(prefix, cachestats))
+        os.replace(filename + ".tmp", filename)
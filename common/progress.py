@@ -0,0 +1,73 @@
+"""
+Progress log of a script, to continue where an interrupted run stopped.
+
+For every processed item the outcome is appended to a JSON lines file. A new
+run skips the items with a settled outcome and retries the others – API
+errors, or items that were never finished.
+"""
+import json
+import os
+import time
+
+MATCHED = "matched"
+NOMATCH = "no-match"
+APIERROR = "api-error"
+EDITED = "edited"
+UNCHANGED = "unchanged"
+
+
+class ProgressLog:
+    """
+    Outcomes of the items processed by a script, by QID.
+
+    Items are settled if their outcome is in `settled`; outcomes in `retry`
+    only for the given number of seconds, e.g. to look for a match again
+    after some time.
+    """
+
+    def __init__(
+        self,
+        filename,
+        settled=(MATCHED, NOMATCH, EDITED, UNCHANGED),
+        retry=None,
+    ):
+        self.filename = filename
+        self.settled = set(settled)
+        self.retry = retry or {}
+        self.outcomes = {}
+        line = "\n"
+        if os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line of a killed run may be incomplete
+                        continue
+                    self.outcomes[entry["qid"]] = (entry["outcome"], entry["time"])
+        self.file = open(filename, "a")
+        if not line.endswith("\n"):
+            self.file.write("\n")
+
+    def issettled(self, qid):
+        if qid not in self.outcomes:
+            return False
+        outcome, logged = self.outcomes[qid]
+        if outcome not in self.settled:
+            return False
+        return outcome not in self.retry or logged + self.retry[outcome] > time.time()
+
+    def pending(self, rows, getqid):
+        """
+        Yield the rows whose item is not settled yet.
+        """
+        for row in rows:
+            if not self.issettled(getqid(row)):
+                yield row
+
+    def record(self, qid, outcome):
+        now = time.time()
+        self.outcomes[qid] = (outcome, now)
+        self.file.write(json.dumps({"qid": qid, "outcome": outcome, "time": now}))
+        self.file.write("\n")
+        self.file.flush()
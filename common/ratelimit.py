@@ -0,0 +1,26 @@
+import threading
+import time
+import urllib.parse
+
+
+class RateLimiter:
+    """
+    Limit the number of requests per second sent to each host.
+
+    The limiter can be shared between threads, every thread calls wait()
+    before sending a request.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.slots = {}
+
+    def wait(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.slots.get(host, now))
+            self.slots[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
@@ -0,0 +1,153 @@
+"""
+Client for the Wikidata Query Service.
+
+The results are parsed while they are downloaded, so even huge result sets
+need only little memory. Optionally the results are cached on disk.
+"""
+import codecs
+import hashlib
+import json
+import os
+import re
+import time
+
+import requests
+
+endpoint = "https://query.wikidata.org/sparql"
+useragent = "wikidata-imports (https://github.com/Nudin/wikidata-imports)"
+
+bindingsstart = re.compile(r'"bindings"\s*:\s*\[')
+
+
+def iterbindings(chunks):
+    """
+    Parse a SPARQL-JSON result given as text chunks and yield the bindings
+    one after another.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        match = bindingsstart.search(buf)
+        if match:
+            break
+    else:
+        raise ValueError("No bindings found in SPARQL result")
+    buf = buf[match.end() :]
+    pos = 0
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            if pos == len(buf):
+                raise json.JSONDecodeError("Need more data", buf, pos)
+            binding, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise ValueError("SPARQL result is truncated")
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield binding
+        if pos > 1 << 16:
+            buf = buf[pos:]
+            pos = 0
+
+
+def decodechunks(response, chunk_size=1 << 16):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in response.iter_content(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+class Client:
+    """
+    Run SPARQL queries against a SPARQL endpoint.
+
+    Connections are kept open between queries. If the server is overloaded
+    (429/503) the query is retried after the time given in the Retry-After
+    header, or with exponential backoff. If `cachedir` is given, results are
+    stored there and reused for `ttl` seconds.
+    """
+
+    def __init__(self, url=endpoint, cachedir=None, ttl=3600, retries=5):
+        self.url = url
+        self.cachedir = cachedir
+        self.ttl = ttl
+        self.retries = retries
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = useragent
+        self.session.headers["Accept"] = "application/sparql-results+json"
+        if cachedir is not None and not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+
+    def request(self, query):
+        for attempt in range(self.retries + 1):
+            r = self.session.get(self.url, params={"query": query}, stream=True)
+            if r.status_code not in (429, 503) or attempt == self.retries:
+                break
+            r.close()
+            retryafter = r.headers.get("Retry-After", "")
+            if retryafter.isdigit():
+                time.sleep(int(retryafter))
+            else:
+                time.sleep(2**attempt)
+        r.raise_for_status()
+        return r
+
+    def cachefile(self, query):
+        return os.path.join(
+            self.cachedir, hashlib.sha1(query.encode()).hexdigest() + ".jsonl"
+        )
+
+    def bindings(self, query, ttl=None):
+        """
+        Run a query and yield the bindings of the result while they arrive.
+        """
+        if self.cachedir is None:
+            with self.request(query) as r:
+                yield from iterbindings(decodechunks(r))
+            return
+        if ttl is None:
+            ttl = self.ttl
+        filename = self.cachefile(query)
+        if os.path.exists(filename) and os.path.getmtime(filename) + ttl > time.time():
+            with open(filename) as f:
+                for line in f:
+                    yield json.loads(line)
+            return
+        # Write to a temporary file, that only replaces the cached result if
+        # the whole result was read
+        tmpfilename = "%s.%i.tmp" % (filename, os.getpid())
+        try:
+            with self.request(query) as r, open(tmpfilename, "w") as f:
+                for binding in iterbindings(decodechunks(r)):
+                    f.write(json.dumps(binding) + "\n")
+                    yield binding
+            os.replace(tmpfilename, filename)
+        finally:
+            if os.path.exists(tmpfilename):
+                os.remove(tmpfilename)
+
+    def values(self, query, ttl=None):
+        """
+        Run a query and yield the results as dicts variable → value.
+        """
+        for binding in self.bindings(query, ttl):
+            yield {k: v["value"] for (k, v) in binding.items()}
+
+
+default = Client()
+
+
+def bindings(query):
+    return default.bindings(query)
+
+
+def values(query):
+    return default.values(query)
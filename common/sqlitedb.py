@@ -0,0 +1,21 @@
+import sqlite3
+
+
+class ThreadLocalDB:
+    """
+    Base class for data stored in the SQLite file `self.filename` and used by
+    several threads. Subclasses set `self.local = threading.local()`.
+    """
+
+    @property
+    def db(self):
+        """
+        The connection to the database – SQLite connections can't be shared
+        between threads, so every thread opens its own.
+        """
+        conn = getattr(self.local, "db", None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.db = conn
+        return conn
@@ -0,0 +1,94 @@
+"""
+Version statements (P348) with date and type of release and a reference.
+
+The statements are built completely before they are saved, and are saved
+together with the rank changes in one edit per item – no partial statements
+remain if a run is interrupted.
+"""
+import re
+
+import pywikibot
+
+from common.editqueue import addqualifier, addsources
+
+STABLE = "Q2804309"
+UNSTABLE = "Q3295609"
+
+
+def wbtime(date):
+    return pywikibot.WbTime(year=date.year, month=date.month, day=date.day)
+
+
+def versionkey(version):
+    """
+    Sort key for version numbers: the numbers in them.
+    """
+    return tuple(int(number) for number in re.findall(r"\d+", version))
+
+
+def versionclaim(repo, version, date=None, releasetype=None, source=None):
+    """
+    A new version claim, with the date of release (P577), the type of release
+    (P548, e.g. STABLE) and a reference (a list of claims) if given.
+    """
+    claim = pywikibot.Claim(repo, "P348", datatype="string")
+    claim.setTarget(version)
+    if date is not None:
+        qualifier = pywikibot.Claim(repo, "P577")
+        qualifier.setTarget(wbtime(date))
+        addqualifier(claim, qualifier)
+    if releasetype is not None:
+        qualifier = pywikibot.Claim(repo, "P548")
+        qualifier.setTarget(pywikibot.ItemPage(repo, releasetype))
+        addqualifier(claim, qualifier)
+    if source is not None:
+        addsources(claim, source)
+    return claim
+
+
+def isstable(claim):
+    return any(
+        qualifier.getTarget() is not None and qualifier.getTarget().getID() == STABLE
+        for qualifier in claim.qualifiers.get("P548", [])
+    )
+
+
+def isunstable(claim):
+    """
+    Whether the claim is qualified with a type of release other than stable.
+    """
+    return any(
+        qualifier.getTarget() is not None and qualifier.getTarget().getID() != STABLE
+        for qualifier in claim.qualifiers.get("P548", [])
+    )
+
+
+def addversions(editqueue, item, claims, summary):
+    """
+    Queue new version claims for a loaded item, to be saved in one edit.
+
+    If the newest new stable version is newer than the versions of the item –
+    except those qualified as unstable, e.g. betas of the next version – it
+    becomes the preferred version and the claims preferred before become
+    normal. The claims are added to item.claims, so the item doesn't have to
+    be loaded again.
+    """
+    if not claims:
+        return
+    existing = item.claims.setdefault("P348", [])
+    changed = list(claims)
+    stable = [claim for claim in claims if isstable(claim)]
+    if stable:
+        newest = max(stable, key=lambda claim: versionkey(claim.getTarget()))
+        if all(
+            versionkey(newest.getTarget()) > versionkey(claim.getTarget() or "")
+            for claim in existing
+            if not isunstable(claim)
+        ):
+            newest.rank = "preferred"
+            for claim in existing:
+                if claim.rank == "preferred":
+                    claim.rank = "normal"
+                    changed.append(claim)
+    existing.extend(claims)
+    editqueue.addclaims(item.getID(), changed, summary, item.latest_revision_id)
@@ -1,11 +1,14 @@
 #!/bin/env python3
-import requests
-import urllib.parse
+import os
+import sys
 import pywikibot
 from colorama import Fore, Back, Style
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import sparql  # noqa: E402
+from common.editqueue import EditQueue  # noqa: E402
+
 
-wdqurl = 'https://query.wikidata.org/sparql?format=json&query='
 query = """
 SELECT ?item ?itemLabel ?itemDescription ?website
 WHERE
@@ -23,15 +26,6 @@ WHERE
 """
 
 
-# Run a Query and get the results block of the returned json
-def runquery(url):
-    r = requests.get(url)
-    if r.status_code == 200:
-        return r.json()["results"]
-    else:
-        return None
-
-
 # Normalise URL
 # so that two urls with probably identical target result are identical
 def normurl(url):
@@ -58,21 +52,23 @@ def getvalue(software, key):
 
 
 def addRepoToItem(qid, name):
-    item = pywikibot.ItemPage(repo, qid)
     archclaim = pywikibot.Claim(repo, 'P1324', datatype='external-id')
     archclaim.setTarget(name)
-    item.addClaim(archclaim, summary=u'Adding arch-package name')
+    editqueue.addclaim(qid, archclaim, 'Adding arch-package name')
 
 
 site = pywikibot.Site("wikidata", "wikidata")
 repo = site.data_repository()
+dname = os.path.dirname(os.path.abspath(__file__))
+editqueue = EditQueue(repo, os.path.join(dname, 'edits.jsonl'))
 
 print("...")
-wdlist = runquery(wdqurl + urllib.parse.quote_plus(query))
+# Read completely, the stream would time out during the slow loop below
+wdlist = list(sparql.bindings(query))
 softwarelist = {}
 qidlist = {}
 done = []
-for software in wdlist['bindings']:
+for software in wdlist:
     print('.', end='', flush=True)
     qid = getvalue(software, 'item')[31:]
     name = getvalue(software, 'itemLabel').lower()
@@ -80,3 +76,4 @@ for software in wdlist['bindings']:
     if software not in done:
         addRepoToItem(qid, website)
         done.append(qid)
+editqueue.flush()
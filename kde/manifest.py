@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Manifest of the KDE Applications on download.kde.org: which application was
+released in which version, in which channel (stable or unstable) and when.
+
+The download tree is crawled once and stored in a SQLite file. Later runs send
+the Last-Modified and ETag of every listing with the request, and only the
+listings that changed are read again. Listings are parsed while they are
+downloaded.
+
+    ./manifest.py                                 # refresh the whole tree
+    ./manifest.py --version 18.08.1 18.11.80      # only these versions
+    ./manifest.py --base http://localhost:8000/   # a local copy of the tree
+"""
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import email.utils
+import html.parser
+import os
+import re
+import sys
+import threading
+import urllib.parse
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.sqlitedb import ThreadLocalDB  # noqa: E402
+
+dname = os.path.dirname(os.path.abspath(__file__))
+
+# Root of the download tree
+baseurl = "https://download.kde.org/"
+channels = ("stable", "unstable")
+# Folders of the releases in a channel: KDE Applications up to 19.08, then the
+# KDE Release Service
+roots = ("applications", "release-service")
+# Listings read at the same time
+workers = 4
+
+# Modification times in the listings of Apache (2018-09-04 22:05) and nginx
+# (04-Sep-2018 22:05)
+listingdates = [
+    (re.compile(r"\b\d{4}-\d{2}-\d{2} \d{2}:\d{2}\b"), "%Y-%m-%d %H:%M"),
+    (re.compile(r"\b\d{2}-[A-Z][a-z]{2}-\d{4} \d{2}:\d{2}\b"), "%d-%b-%Y %H:%M"),
+]
+
+
+class ListingParser(html.parser.HTMLParser):
+    """
+    Entries of a directory listing as [name, date] – date is None if the
+    listing has no modification times. Folders end with a slash.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+        self.text = ""
+
+    def handle_starttag(self, tag, attrs):
+        self.text += " "
+        if tag != "a":
+            return
+        href = dict(attrs).get("href")
+        # No sort links, parent folders or other sites
+        if not href or href[0] in "?#/." or "://" in href:
+            return
+        name = urllib.parse.unquote(href)
+        # Signatures, checksums and mirror lists of the previous entry
+        if self.entries and name.startswith(self.entries[-1][0]):
+            return
+        self.entries.append([name, None])
+        self.text = ""
+
+    def handle_endtag(self, tag):
+        self.text += " "
+
+    def handle_data(self, data):
+        if not self.entries or self.entries[-1][1] is not None:
+            return
+        # The text after an entry, it may come in pieces
+        self.text += data
+        for pattern, dateformat in listingdates:
+            match = pattern.search(self.text)
+            if match:
+                date = datetime.datetime.strptime(match.group(), dateformat)
+                self.entries[-1][1] = date.date().isoformat()
+                break
+
+
+class Manifest(ThreadLocalDB):
+    """
+    The releases in the download tree below `base`, stored in a SQLite file.
+    """
+
+    def __init__(
+        self,
+        filename=os.path.join(dname, "manifest.sqlite"),
+        base=baseurl,
+        session=None,
+    ):
+        self.filename = filename
+        self.base = base if base.endswith("/") else base + "/"
+        self.session = session or requests.Session()
+        self.local = threading.local()
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                url TEXT PRIMARY KEY,
+                lastmodified TEXT,
+                etag TEXT,
+                entries TEXT
+            );
+            CREATE TABLE IF NOT EXISTS releases (
+                app TEXT,
+                version TEXT,
+                channel TEXT,
+                date TEXT,
+                url TEXT,
+                PRIMARY KEY (app, version, channel)
+            );
+            CREATE INDEX IF NOT EXISTS releases_version ON releases (version, channel);
+        """)
+
+    def listing(self, url):
+        """
+        Read a listing, if it changed since it was stored. Return the entries
+        and the validators (Last-Modified, ETag) or None if it is unchanged.
+        A missing folder is empty.
+        """
+        row = self.db.execute(
+            "SELECT lastmodified, etag FROM dirs WHERE url = ?", (url,)
+        ).fetchone()
+        headers = {}
+        if row is not None and row[0]:
+            headers["If-Modified-Since"] = row[0]
+        if row is not None and row[1]:
+            headers["If-None-Match"] = row[1]
+        with self.session.get(url, headers=headers, stream=True, timeout=60) as r:
+            if r.status_code == 304:
+                return None
+            if r.status_code == 404:
+                return [], (None, None)
+            r.raise_for_status()
+            parser = ListingParser()
+            r.encoding = r.encoding or "utf-8"
+            for chunk in r.iter_content(chunk_size=65536, decode_unicode=True):
+                parser.feed(chunk)
+            parser.close()
+            return parser.entries, (
+                r.headers.get("Last-Modified"),
+                r.headers.get("ETag"),
+            )
+
+    def filedate(self, url):
+        """
+        Modification time of a file, for listings without them.
+        """
+        r = self.session.head(url, allow_redirects=True, timeout=60)
+        r.raise_for_status()
+        if "Last-Modified" not in r.headers:
+            return None
+        date = email.utils.parsedate_to_datetime(r.headers["Last-Modified"])
+        return date.date().isoformat()
+
+    def subdirs(self, url):
+        """
+        Names of the folders in a folder, from the stored listing if it didn't
+        change.
+        """
+        result = self.listing(url)
+        if result is None:
+            row = self.db.execute(
+                "SELECT entries FROM dirs WHERE url = ?", (url,)
+            ).fetchone()
+            names = row[0].split("\n") if row[0] else []
+        else:
+            entries, validators = result
+            names = [name for name, date in entries]
+            self.db.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                (url, *validators, "\n".join(names)),
+            )
+        return [name[:-1] for name in names if name.endswith("/")]
+
+    def readversion(self, channel, version, url):
+        """
+        Read the tarballs of a version, if its listing changed. Return the
+        entries, validators and releases of the listing, or None.
+        """
+        result = self.listing(url)
+        if result is None:
+            return None
+        entries, validators = result
+        known = dict(
+            self.db.execute(
+                "SELECT app, date FROM releases WHERE version = ? AND channel = ?",
+                (version, channel),
+            )
+        )
+        tarball = re.compile(r"([\w-]+)-" + re.escape(version) + r"\.tar\.(xz|bz2)")
+        releases = []
+        for name, date in entries:
+            match = tarball.fullmatch(name)
+            if not match:
+                continue
+            app = match.group(1)
+            if date is None:
+                date = known.get(app) or self.filedate(url + urllib.parse.quote(name))
+            releases.append((app, version, channel, date, url))
+        return entries, validators, releases
+
+    def refresh(self, versions=None):
+        """
+        Read the listings that changed – of the given versions only, if
+        `versions` is given. Return the number of listings read and unchanged.
+        """
+        todo = []
+        for channel in channels:
+            for root in roots:
+                url = "%s%s/%s/" % (self.base, channel, root)
+                for version in self.subdirs(url):
+                    if not re.fullmatch(r"\d+(\.\d+)+", version):
+                        continue
+                    if versions is None or version in versions:
+                        todo.append((channel, version, "%s%s/src/" % (url, version)))
+
+        stats = collections.Counter()
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            futures = [pool.submit(self.readversion, *args) for args in todo]
+            for (channel, version, url), future in zip(todo, futures):
+                result = future.result()
+                if result is None:
+                    stats["unchanged"] += 1
+                    continue
+                entries, validators, releases = result
+                # The validators only together with the releases, so an
+                # interrupted run reads the listing again
+                self.db.execute("BEGIN")
+                self.db.execute(
+                    "DELETE FROM releases WHERE version = ? AND channel = ?",
+                    (version, channel),
+                )
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO releases VALUES (?, ?, ?, ?, ?)", releases
+                )
+                self.db.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                    (url, *validators, "\n".join(name for name, date in entries)),
+                )
+                self.db.execute("COMMIT")
+                stats["read"] += 1
+        return stats
+
+    def apps(self, version, channel):
+        return {
+            row[0]
+            for row in self.db.execute(
+                "SELECT app FROM releases WHERE version = ? AND channel = ?",
+                (version, channel),
+            )
+        }
+
+    def srcurl(self, version, channel):
+        """
+        The folder of the tarballs of a version, None if there are none.
+        """
+        row = self.db.execute(
+            "SELECT url FROM releases WHERE version = ? AND channel = ? LIMIT 1",
+            (version, channel),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def releases(self, app):
+        """
+        All releases of an application as (version, channel, date, url).
+        """
+        return self.db.execute(
+            "SELECT version, channel, date, url FROM releases WHERE app = ?", (app,)
+        ).fetchall()
+
+    def summary(self):
+        return self.db.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT app), COUNT(DISTINCT version) "
+            "FROM releases"
+        ).fetchone()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--base",
+        default=baseurl,
+        help="root of the download tree (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--version", nargs="+", help="only read the folders of these versions"
+    )
+    args = parser.parse_args()
+
+    manifest = Manifest(base=args.base)
+    stats = manifest.refresh(args.version and set(args.version))
+    print("%i listings read, %i unchanged" % (stats["read"], stats["unchanged"]))
+    print("%i releases of %i applications in %i versions" % manifest.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,101 +1,194 @@
 #!/bin/env python3
+"""
+Add releases of KDE Applications to the items of the applications.
+
+Releases are given as version:date, unstable releases (betas and release
+candidates) as version:date:unstable, e.g.
+
+    ./update.py 18.08.1:2018-09-06 18.08.2:2018-10-11 18.11.80:2018-10-19:unstable
+
+Every application, that has one of the releases in its download folder and
+doesn't have the version on Wikidata yet, gets the new version numbers with
+date of release, type of release and source. The newest stable version
+becomes the preferred one. All changes to an item are saved in one edit.
+
+The download folders are read from the manifest of download.kde.org (see
+manifest.py). With --backfill every application gets all versions of the
+manifest that are missing on Wikidata, with the date of the tarball as date
+of release.
+"""
+import argparse
+import collections
 import datetime
+import os
 import re
-import urllib.parse
+import sys
 
 import pywikibot
-import requests
 
-oldversion = "18.08.1"
-newversion = "18.08.2"
-pdate = pywikibot.WbTime(2018, 10, 9)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import sparql  # noqa: E402
+from common.editqueue import EditQueue  # noqa: E402
+from common.statements import (  # noqa: E402
+    STABLE,
+    UNSTABLE,
+    addversions,
+    versionclaim,
+    versionkey,
+)
+from manifest import Manifest  # noqa: E402
 
+srctitle = "Download archive"
 
-wdqurl = "https://query.wikidata.org/sparql?format=json&query="
-query = (
-    """
-select distinct ?item ?itemLabel where {
-     ?item wdt:P361 wd:Q20712193.
-     ?item wdt:P348 ?vers.
-     FILTER (?vers = "%s")
-     ?item rdfs:label ?itemLabel filter (lang(?itemLabel) = "en") .
-} order by ?item
+# All items of KDE Applications with their version numbers of the KDE release
+# scheme (YY.MM.patch)
+query = """
+select ?item ?itemLabel (group_concat(?vers; separator="|") as ?versions) where {
+  ?item wdt:P361 wd:Q20712193.
+  ?item p:P348/ps:P348 ?vers.
+  FILTER REGEX(?vers, "^[0-9]+\\\\.[0-9]+\\\\.[0-9]+$")
+  ?item rdfs:label ?itemLabel filter (lang(?itemLabel) = "en") .
+} group by ?item ?itemLabel
 """
-    % oldversion
-)
+
+Release = collections.namedtuple("Release", ["version", "date", "unstable", "url"])
+
+
+def parserelease(arg):
+    parts = arg.split(":")
+    if len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] != "unstable"):
+        raise argparse.ArgumentTypeError("expected version:date[:unstable]")
+    if not re.fullmatch(r"\d+(\.\d+)*", parts[0]):
+        raise argparse.ArgumentTypeError("invalid version %s" % parts[0])
+    try:
+        date = datetime.datetime.strptime(parts[1], "%Y-%m-%d").date()
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return Release(parts[0], date, len(parts) == 3, None)
+
+
+def channel(release):
+    return "unstable" if release.unstable else "stable"
 
 
-def runquery(url):
-    r = requests.get(url)
-    if r.status_code == 200:
-        return r.json()["results"]
+def createsource(release):
+    statedin = pywikibot.Claim(repo, "P854")
+    statedin.setTarget(release.url)
+    title = pywikibot.Claim(repo, "P1476")
+    title.setTarget(pywikibot.WbMonolingualText(srctitle, "en"))
+    retrieved = pywikibot.Claim(repo, "P813")
+    today = datetime.datetime.utcnow().date()
+    retrieved.setTarget(
+        pywikibot.WbTime(year=today.year, month=today.month, day=today.day)
+    )
+    return [statedin, title, retrieved]
+
+
+def update(item, releases):
+    """
+    Queue the releases that are missing on the item, the item has to be
+    loaded. Return the added versions.
+    """
+    existing = {claim.getTarget() for claim in item.claims.get("P348", [])}
+    claims = [
+        versionclaim(
+            repo,
+            release.version,
+            release.date,
+            UNSTABLE if release.unstable else STABLE,
+            createsource(release),
+        )
+        for release in releases
+        if release.version not in existing
+    ]
+    versions = [claim.getTarget() for claim in claims]
+    if len(versions) <= 10:
+        summary = "Add KDE Applications versions (%s)" % ", ".join(versions)
     else:
-        return None
+        summary = "Add %i KDE Applications versions" % len(versions)
+    addversions(editqueue, item, claims, summary)
+    return versions
 
 
-site = pywikibot.Site("wikidata", "wikidata")
-repo = site.data_repository()
+def main():
+    parser = argparse.ArgumentParser(
+        description="Add releases of KDE Applications to Wikidata.",
+        epilog="Example: %(prog)s 18.08.2:2018-10-11 18.11.80:2018-10-19:unstable",
+    )
+    parser.add_argument(
+        "releases",
+        nargs="*",
+        type=parserelease,
+        metavar="version:date[:unstable]",
+    )
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="add all versions of the manifest that are missing on Wikidata",
+    )
+    args = parser.parse_args()
+    if not args.releases and not args.backfill:
+        parser.error("give releases or --backfill")
 
-wdlist = runquery(wdqurl + urllib.parse.quote_plus(query))
+    manifest = Manifest()
+    if args.backfill:
+        manifest.refresh()
+    else:
+        manifest.refresh({release.version for release in args.releases})
+    releases = []
+    for release in sorted(args.releases, key=lambda r: versionkey(r.version)):
+        url = manifest.srcurl(release.version, channel(release))
+        if url is None:
+            raise LookupError("No tarballs found for %s" % release.version)
+        releases.append(release._replace(url=url))
+    apps = {
+        release: manifest.apps(release.version, channel(release))
+        for release in releases
+    }
 
-srcurl = "https://download.kde.org/stable/applications/%s/src/" % newversion
-r = requests.get(srcurl)
-assert r.status_code == 200
+    # Releases for every item: those with the app in the download folder and
+    # missing on Wikidata – a stable point release may come after a beta of
+    # the next version, so newer or older doesn't matter
+    todo = {}
+    for software in list(sparql.bindings(query)):
+        qid = software["item"]["value"][31:]
+        name = software["itemLabel"]["value"].lower()
+        versions = software["versions"]["value"].split("|")
+        missing = [
+            release
+            for release in releases
+            if name in apps[release] and release.version not in versions
+        ]
+        if args.backfill:
+            missing += [
+                Release(
+                    version,
+                    date and datetime.date.fromisoformat(date),
+                    channelname == "unstable",
+                    url,
+                )
+                for version, channelname, date, url in manifest.releases(name)
+                if version not in versions
+                and version not in (release.version for release in missing)
+            ]
+            missing.sort(key=lambda r: versionkey(r.version))
+        if missing:
+            todo[qid] = (name, missing)
+        else:
+            print(name, "– up to date or not released")
 
-srctitle = "Download archive"
-statedin = pywikibot.Claim(repo, "P854")
-statedin.setTarget(srcurl)
-title = pywikibot.Claim(repo, "P1476")
-title.setTarget(pywikibot.WbMonolingualText(srctitle, "en"))
-retrieved = pywikibot.Claim(repo, "P813")
-today = datetime.datetime.utcnow().date()
-date = pywikibot.WbTime(year=today.year, month=today.month, day=today.day)
-retrieved.setTarget(date)
-
-lines = re.findall(r"\b\w+-" + re.escape(newversion) + r".tar.xz\b", r.text)
-cutof = len(newversion) + len("-.tar.xz")
-lines = set(map(lambda l: l[0:-cutof], lines))
-assert len(lines) > 0
-
-for software in wdlist["bindings"]:
-    qid = software["item"]["value"][31:]
-    name = software["itemLabel"]["value"]
-    print(name)
-    if name.lower() not in lines:
-        print("skipping")
-        continue
-    item = pywikibot.ItemPage(repo, qid)
-    item.get()
-    # Check if version is already there
-    if "P348" in item.claims and newversion in map(
-        lambda x: x.getTarget(), item.claims["P348"]
-    ):
-        continue
-    newclaim = pywikibot.Claim(repo, "P348", datatype="string")
-    newclaim.setTarget(newversion)
-    item.addClaim(newclaim, summary="Add Update Version (%s)" % newversion)
-    item.get(force=True)
-    try:
-        newclaim.changeRank("preferred")
-    except AssertionError:
-        print("Setting rank failed.")
-    # add release date
-    qualifier = pywikibot.Claim(repo, "P577")
-    qualifier.setTarget(pdate)
-    newclaim.addQualifier(qualifier, summary="Adding a date of release.")
-    # add stable release
-    qualifier = pywikibot.Claim(repo, "P548")
-    qualifier.setTarget(pywikibot.ItemPage(repo, "Q2804309"))
-    newclaim.addQualifier(qualifier, summary="Adding stable release")
-    # add source
-    newclaim.addSources([statedin, title, retrieved], summary="Adding source.")
-    # set old ranks back
-    item.get(force=True)
-    for oldclaim in item.claims["P348"]:
-        if oldclaim.getTarget() == newversion:
-            continue
-        try:
-            if oldclaim.getRank() == "preferred":
-                oldclaim.changeRank("normal")
-        except AssertionError:
-            print("Setting rank back failed.")
+    pages = [pywikibot.ItemPage(repo, qid) for qid in todo]
+    for item in repo.preload_entities(pages, 50):
+        name, missing = todo[item.getID()]
+        print(name, ", ".join(update(item, missing)))
+    editqueue.flush()
+
+
+site = pywikibot.Site("wikidata", "wikidata")
+repo = site.data_repository()
+editqueue = EditQueue(
+    repo, os.path.join(os.path.dirname(os.path.abspath(__file__)), "edits.jsonl")
+)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,37 @@
 #!/usr/bin/env python3
+import argparse
 import xml
 
-import pywikibot
 from tqdm import tqdm
 
 import oloho
+from common.editqueue import apply
+from common.progress import APIERROR, EDITED, NOMATCH, UNCHANGED, ProgressLog
+from mapping import LabelIndex
 from wikidata import (create_andor_source, create_claim, create_target,
-                      createsource, get_counters, get_mapping, runquery,
-                      wikidata)
+                      createsource, edit, flush, get_counters, plan,
+                      preloaditems, runquery)
+
+parser = argparse.ArgumentParser(
+    description="Import data from Open Hub for all items with an Open Hub id."
+)
+parser.add_argument(
+    "--plan",
+    metavar="CHANGESET",
+    help="don't edit, write the changes to this file (JSON lines)",
+)
+parser.add_argument(
+    "--apply", metavar="CHANGESET", help="send the changes of a changeset and exit"
+)
+args = parser.parse_args()
+
+if args.apply is not None:
+    apply(args.apply, edit())
+    raise SystemExit
+if args.plan is not None:
+    plan(args.plan)
+else:
+    edit()
 
 
 def coroutine(func):
@@ -21,6 +45,12 @@ def coroutine(func):
 
 @coroutine
 def translator(filename):
+    # Labels of all languages and licenses used on Wikidata, then a few names
+    # used by Open Hub
+    indexes = {
+        "lang": LabelIndex("P277").start(),
+        "license": LabelIndex("P275").start(),
+    }
     tranlation_dict = {}
     tranlation_dict["lang"] = {
         "c": "Q15777",
@@ -28,7 +58,6 @@ def translator(filename):
         "perl": "Q42478",
         "tcl": "Q5288",
         "lisp": "Q132874",
-        **get_mapping("P277"),
     }
 
     tranlation_dict["license"] = {
@@ -46,7 +75,6 @@ def translator(filename):
         'bsd 2-clause "freebsd" license': "Q18517294",
         "zlib license (aka zlib/libpng)": "Q207243",
         "gnu lesser general public license v2.1 only": "Q18534390",
-        **get_mapping("P275"),
     }
     with open(filename, "w") as f:
         while True:
@@ -54,9 +82,9 @@ def translator(filename):
             if type(obj) != str:
                 yield None
                 continue
-            obj = obj.lower()
-            if obj in tranlation_dict[group]:
-                yield tranlation_dict[group][obj]
+            qid = indexes[group].get(obj, tranlation_dict[group].get(obj.lower()))
+            if qid is not None:
+                yield qid
             else:
                 f.write(main_lang + "\n")
                 f.flush()
@@ -72,40 +100,69 @@ SELECT DISTINCT ?item ?itemLabel ?openhubname WHERE
 }
 """
 
+
+def fetch(entry):
+    software, _ = entry
+    openhubname = software["openhubname"]["value"]
+    return oloho.getprojectdata(openhubname), oloho.getenlistments(openhubname)
+
+
+def getqid(software):
+    return software["item"]["value"][31:]
+
+
 mytranslator = translator("unmatched_license_lang")
 
+# Items done by earlier runs are skipped, projects not found are looked up
+# again after 30 days. Planning has its own log, as the planned edits are not
+# done yet.
+if args.plan is None:
+    progressfile = "access-progress.jsonl"
+else:
+    progressfile = args.plan + ".progress"
+progress = ProgressLog(progressfile, retry={NOMATCH: 30 * 24 * 3600})
+
 # Get list of wikidata-items to edit
-wdlist = runquery(query)
+wdlist = list(progress.pending(runquery(query), getqid))
 
-oloho.use_key(1)
+# The items are loaded and the Open Hub data fetched ahead of the loop, that
+# only decides which edits to make
+pipeline = oloho.imap(fetch, preloaditems(wdlist))
 
-with tqdm(wdlist, postfix="Api calls: ") as t:
-    for software in t:
-        qid = software["item"]["value"][31:]
+with tqdm(pipeline, total=len(wdlist), postfix="Api calls: ") as t:
+    for (software, item), result in t:
         softwarename = software["itemLabel"]["value"]
         openhubname = software["openhubname"]["value"]
 
         t.write("\n= {} – {} =".format(softwarename, openhubname))
         try:
-            project = oloho.getprojectdata(openhubname)
-            enlistments = oloho.getenlistments(openhubname)
+            project, enlistments = result.result()
+        except oloho.APIError as e:
+            t.write(str(e))
+            progress.record(getqid(software), APIERROR)
+            continue
         except LookupError as e:
             t.write(str(e))
+            progress.record(getqid(software), NOMATCH)
             continue
         except xml.etree.ElementTree.ParseError:
             t.write("No valid XML found, project was probably deleted")
+            progress.record(getqid(software), NOMATCH)
             continue
         except PermissionError:
             t.write("API Limit Exceeded")
             break
-        t.postfix = "Api calls: %i" % oloho.cache_miss
-        item = pywikibot.ItemPage(wikidata, qid)
+        t.postfix = "Api calls: %i, left: %i" % (
+            oloho.cache_miss,
+            oloho.keys.remaining(),
+        )
         item.get()
+        counters = get_counters()
 
         # Add source repositories
         if len(enlistments) == 1:
-            repo_url = enlistments[0].findtext("code_location/url")
-            repo_type = enlistments[0].findtext("code_location/type")
+            repo_url = enlistments[0]["url"]
+            repo_type = enlistments[0]["type"]
             if repo_type == "git":
                 t.write(" {} - {}".format(repo_url, repo_type))
                 source = createsource(
@@ -118,7 +175,7 @@ with tqdm(wdlist, postfix="Api calls: ") as t:
                 create_andor_source(item, "P1324", target, qualifier, source, t.write)
 
         # Add main programing language
-        main_lang = project.findtext("analysis/main_language_name")
+        main_lang = project["main_language_name"]
         lqid = mytranslator.send(("lang", main_lang))
         if lqid is not None:
             t.write(" {} - {}".format(main_lang, lqid))
@@ -131,7 +188,7 @@ with tqdm(wdlist, postfix="Api calls: ") as t:
             create_andor_source(item, "P277", target, None, source, t.write)
 
         # Add project license
-        licensename = project.findtext("licenses/license/name")
+        licensename = project["license"]
         lqid = mytranslator.send(("license", licensename))
         if lqid is not None:
             t.write(" {} - {}".format(licensename, lqid))
@@ -150,5 +207,9 @@ with tqdm(wdlist, postfix="Api calls: ") as t:
         #     t.write(forum)
         #     pass  # Wikidata-Editing
 
+        outcome = EDITED if get_counters() != counters else UNCHANGED
+        progress.record(getqid(software), outcome)
+
+flush()
 
 t.write("Added {} statements & sourced {} existing statements".format(*get_counters()))
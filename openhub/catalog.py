@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Local catalog of all Open Hub projects, to match items without API calls.
+
+The catalog is built from the list of all projects, a few pages per run (every
+page is one API call), and continues where the last run stopped. Projects are
+indexed by url_name, normalised name, homepage and – once their enlistments
+were fetched – repository URL.
+"""
+import argparse
+import os
+import re
+import threading
+
+import unidecode
+
+import oloho
+from common.sqlitedb import ThreadLocalDB
+
+dname = os.path.dirname(os.path.abspath(__file__))
+
+
+# Normalise URL
+# so that two urls with probably identical target result are identical
+def normurl(url):
+    if url is None:
+        return ""
+    url = url.lower()
+    # special treatment for kde/gnome – they often have more than one site
+    # and theres never more than one kde/gnome-application with the same name
+    if "kde.org" in url:
+        return "kde.org"
+    if "gnome.org" in url:
+        return "gnome.org"
+    url = url.replace("://www.", "://")
+    url = re.sub(r"^[a-z]+://", "", url)
+    url = url.replace("index.html", "")
+    url = url.replace("index.htm", "")
+    url = url.replace("index.php", "")
+    url = re.sub(r"http://(.*).sourceforge.net", r"http://sourceforge.net/p/\1", url)
+    if url != "" and url[-1] == "/":
+        url = url[0:-1]
+    return url
+
+
+# Normalised URLs shared by all projects of KDE and GNOME, see normurl
+sharedurls = {"kde.org", "gnome.org"}
+
+
+def normname(name):
+    if name is None:
+        return ""
+    return re.sub(r"[^a-z0-9]", "", unidecode.unidecode(name).lower())
+
+
+class Catalog(ThreadLocalDB):
+    """
+    The projects of the catalog, stored in a SQLite file.
+    """
+
+    def __init__(self, filename=os.path.join(dname, "catalog.sqlite")):
+        self.filename = filename
+        self.local = threading.local()
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS projects (
+                url_name TEXT PRIMARY KEY,
+                name TEXT,
+                normname TEXT,
+                homepage_url TEXT,
+                homepage TEXT
+            );
+            CREATE INDEX IF NOT EXISTS projects_normname ON projects (normname);
+            CREATE INDEX IF NOT EXISTS projects_homepage ON projects (homepage);
+            CREATE TABLE IF NOT EXISTS repos (
+                repo TEXT,
+                url_name TEXT,
+                PRIMARY KEY (repo, url_name)
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+        """)
+
+    def getmeta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def setmeta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    @property
+    def complete(self):
+        """
+        Whether all projects were read at least once.
+        """
+        return bool(self.getmeta("complete", False))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+
+    def add(self, project):
+        self.db.execute(
+            "INSERT OR REPLACE INTO projects VALUES (?, ?, ?, ?, ?)",
+            (
+                project["url_name"],
+                project["name"],
+                normname(project["name"]),
+                project["homepage_url"],
+                normurl(project["homepage_url"]),
+            ),
+        )
+
+    def addenlistments(self, url_name, enlistments):
+        self.db.executemany(
+            "INSERT OR IGNORE INTO repos VALUES (?, ?)",
+            [(normurl(e["url"]), url_name) for e in enlistments if e["url"]],
+        )
+
+    def candidates(self, name, website):
+        """
+        Get the projects that could be the software with this name and
+        website (or repository), best candidates first: same repository,
+        same homepage, same name. KDE and GNOME projects are only found by
+        their name, their URLs all look the same after normurl.
+        """
+        website = normurl(website)
+        if website in sharedurls:
+            website = None
+        rows = self.db.execute(
+            """SELECT p.url_name, p.name, p.homepage_url FROM repos r
+            JOIN projects p ON p.url_name = r.url_name WHERE r.repo = ?
+            UNION ALL
+            SELECT url_name, name, homepage_url FROM projects WHERE homepage = ?
+            UNION ALL
+            SELECT url_name, name, homepage_url FROM projects WHERE normname = ?""",
+            (website, website, normname(name)),
+        )
+        projects = []
+        for url_name, projectname, homepage_url in rows:
+            if url_name not in (p["url_name"] for p in projects):
+                projects.append(
+                    {
+                        "url_name": url_name,
+                        "name": projectname,
+                        "homepage_url": homepage_url,
+                    }
+                )
+        return projects
+
+    def build(self, pages):
+        """
+        Read at most `pages` further pages of the project list.
+        """
+        page = self.getmeta("page", 1)
+        for _ in range(pages):
+            listing = oloho.getlisting(page)
+            for project in listing["projects"]:
+                self.add(project)
+            if not listing["projects"] or len(self) >= listing["available"]:
+                # Start at this page next time, to get the projects added later
+                self.setmeta("complete", True)
+                break
+            page += 1
+            self.setmeta("page", page)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--pages",
+        type=int,
+        default=100,
+        help="read at most this many pages, i.e. API calls (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    catalog = Catalog()
+    try:
+        catalog.build(args.pages)
+    except PermissionError:
+        print("API Limit Exceeded")
+    print("%i projects%s" % (len(catalog), "" if catalog.complete else ", incomplete"))
+
+
+if __name__ == "__main__":
+    main()
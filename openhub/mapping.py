@@ -0,0 +1,137 @@
+"""
+Index of the English labels and aliases of the values of a property, to
+translate names like licenses or programming languages to items.
+
+The labels are stored in a file, so a run doesn't have to wait for the query
+service. The index is refreshed in the background: only the values that were
+changed since the last refresh are queried, and every refreshinterval all
+values.
+"""
+import datetime
+import json
+import os
+import re
+import threading
+
+from wikidata import runquery
+
+dname = os.path.dirname(os.path.abspath(__file__))
+
+# Query all values again after this time, to notice values no longer used
+refreshinterval = datetime.timedelta(days=30)
+
+query = """
+SELECT DISTINCT ?object ?label WHERE
+{
+  ?item wdt:%s ?object.
+  %s
+  ?object rdfs:label|skos:altLabel ?label.
+  FILTER (lang(?label) = "en")
+}
+"""
+modifiedfilter = """?object schema:dateModified ?modified.
+  FILTER (?modified >= "%s"^^xsd:dateTime)"""
+
+ignored = re.compile(r"[^\w+#]|_")
+
+
+def normalize(label):
+    """
+    Casefold and remove whitespace and punctuation – except + and #, to keep
+    C, C++ and C# apart.
+    """
+    return ignored.sub("", label.casefold())
+
+
+class LabelIndex:
+    """
+    Labels of the values of the property `prop` and the items they belong to.
+
+    Labels used by more than one item are ambiguous and not translated.
+    """
+
+    def __init__(self, prop, filename=None):
+        self.prop = prop
+        if filename is None:
+            filename = os.path.join(dname, "mapping_%s.json" % prop)
+        self.filename = filename
+        self.labels = {}
+        self.full = None
+        self.updated = None
+        self.index = {}
+        self.ambiguous = set()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                state = json.load(f)
+            self.labels = state["labels"]
+            self.full = state["full"]
+            self.updated = state["updated"]
+            self.build()
+
+    def build(self):
+        index = {}
+        ambiguous = set()
+        for qid, labels in self.labels.items():
+            for key in {normalize(label) for label in labels}:
+                if key in index and index[key] != qid:
+                    ambiguous.add(key)
+                index[key] = qid
+        for key in ambiguous:
+            del index[key]
+        # Replaced, not changed, so lookups during a refresh are safe
+        self.index = index
+        self.ambiguous = ambiguous
+
+    def get(self, label, default=None):
+        return self.index.get(normalize(label), default)
+
+    def fetch(self, since=None):
+        """
+        Query the labels of all values, or of the values changed since the
+        given time, as dict item → labels.
+        """
+        if since is None:
+            results = runquery(query % (self.prop, ""))
+        else:
+            results = runquery(query % (self.prop, modifiedfilter % since))
+        labels = {}
+        for row in results:
+            qid = row["object"]["value"][31:]
+            labels.setdefault(qid, []).append(row["label"]["value"])
+        return labels
+
+    def refresh(self):
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        full = self.full is None or now - fromiso(self.full) > refreshinterval
+        if full:
+            labels = self.fetch()
+        else:
+            labels = dict(self.labels)
+            labels.update(self.fetch(self.updated))
+        self.labels = labels
+        self.updated = now.isoformat() + "Z"
+        if full:
+            self.full = self.updated
+        self.build()
+        self.save()
+
+    def save(self):
+        state = {"labels": self.labels, "full": self.full, "updated": self.updated}
+        with open(self.filename + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.filename + ".tmp", self.filename)
+
+    def start(self):
+        """
+        Refresh the index – in the background if it was stored before, else
+        right now.
+        """
+        if self.updated is None:
+            self.refresh()
+        else:
+            threading.Thread(target=self.refresh, daemon=True).start()
+        return self
+
+
+def fromiso(timestamp):
+    return datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
@@ -8,6 +8,8 @@ import unidecode
 from tqdm import tqdm
 
 import oloho
+from catalog import Catalog, normurl
+from common.progress import APIERROR, EDITED, MATCHED, NOMATCH, ProgressLog
 from wikidata import create_claim, create_target, runquery, wikidata
 
 query = """
@@ -33,86 +35,113 @@ SELECT DISTINCT ?item ?itemLabel ?website WHERE
 """
 
 
-# Normalise URL
-# so that two urls with probably identical target result are identical
-def normurl(url):
-    if url is None:
-        return ""
-    url = url.lower()
-    # special treatment for kde/gnome – they often have more than one site
-    # and theres never more than one kde/gnome-application with the same name
-    if "kde.org" in url:
-        return "kde.org"
-    if "gnome.org" in url:
-        return "gnome.org"
-    url = url.replace("://www.", "://")
-    url = re.sub(r"^[a-z]+://", "", url)
-    url = url.replace("index.html", "")
-    url = url.replace("index.htm", "")
-    url = url.replace("index.php", "")
-    url = re.sub(r"http://(.*).sourceforge.net", r"http://sourceforge.net/p/\1", url)
-    if url != "" and url[-1] == "/":
-        url = url[0:-1]
-    return url
-
-
-oloho.use_key(0)
+def guessname(softwarename):
+    guessed_name = re.sub(r"[ .]", "_", softwarename).lower()
+    guessed_name = unidecode.unidecode(guessed_name)
+    return re.sub(r"[^a-z_-]", "", guessed_name)
+
+
+# Confirm at most this many candidates from the catalog, every one costs an
+# API call
+maxcandidates = 3
+
+
+def fetch(software):
+    """
+    Find the project of an item: look for candidates in the local catalog and
+    confirm them by their repository. Only if the catalog is still incomplete
+    and has no candidate the API is searched.
+    """
+    softwarename = software["itemLabel"]["value"]
+    website = software["website"]["value"]
+    projects = projectcatalog.candidates(softwarename, website)
+    if not projects:
+        if projectcatalog.complete:
+            raise LookupError("Project not in catalog")
+        projects = [oloho.findproject(guessname(softwarename), softwarename)]
+    tried = []
+    for project in projects[:maxcandidates]:
+        enlistments = oloho.getenlistments(project["url_name"])
+        projectcatalog.addenlistments(project["url_name"], enlistments)
+        tried.append((project, enlistments))
+        repo_url = enlistments[0]["url"] if len(enlistments) == 1 else ""
+        if normurl(repo_url) == normurl(website):
+            return project, enlistments
+    # Not confirmed, the mismatch is reported by the caller
+    return tried[0]
+
+
+def getqid(software):
+    return software["item"]["value"][31:]
+
+
+projectcatalog = Catalog()
+
+# Items done by earlier runs are skipped, items without match are tried again
+# after 30 days
+progress = ProgressLog("match-progress.jsonl", retry={NOMATCH: 30 * 24 * 3600})
+
 counter = 0
 
 
 # Get list of wikidata-items to edit
-wdlist = runquery(query)
+wdlist = list(progress.pending(runquery(query), getqid))
 
 done = []
 with tqdm(wdlist, postfix="Api calls: ") as t:
-    for software in t:
-        qid = software["item"]["value"][31:]
+    for software, result in oloho.imap(fetch, t):
+        qid = getqid(software)
         softwarename = software["itemLabel"]["value"]
         website = software["website"]["value"]
-        guessed_name = re.sub(r"[ .]", "_", softwarename).lower()
-        guessed_name = unidecode.unidecode(guessed_name)
-        guessed_name = re.sub(r"[^a-z_-]", "", guessed_name)
+        guessed_name = guessname(softwarename)
         if softwarename in done:
             continue
 
         t.write("\n= {} - {} =".format(softwarename, guessed_name))
         try:
-            project = oloho.findproject(guessed_name, softwarename)
-            guessed_name = project.findtext("url_name")
-            enlistments = oloho.getenlistments(guessed_name)
+            project, enlistments = result.result()
+            guessed_name = project["url_name"]
+        except oloho.APIError as e:
+            t.write(str(e))
+            progress.record(qid, APIERROR)
+            continue
         except LookupError as e:
             t.write(str(e))
+            progress.record(qid, NOMATCH)
             continue
         except xml.etree.ElementTree.ParseError:
             t.write("No valid XML found, project was probably deleted")
+            progress.record(qid, NOMATCH)
             continue
         except PermissionError:
             t.write("API Limit Exceeded")
             break
-        t.postfix = "Api calls: %i" % oloho.cache_miss
+        t.postfix = "Api calls: %i, left: %i" % (
+            oloho.cache_miss,
+            oloho.keys.remaining(),
+        )
         item = pywikibot.ItemPage(wikidata, qid)
 
-        website_oh = project.findtext("homepage_url")
+        website_oh = project["homepage_url"]
         repo_url = ""
         if len(enlistments) == 1:
-            repo_url = enlistments[0].findtext("code_location/url")
+            repo_url = enlistments[0]["url"]
         if normurl(website) == normurl(repo_url):
             t.write("match!")
             item.get()
             done.append(softwarename)
             if "P1972" in item.claims:
+                progress.record(qid, MATCHED)
                 continue
             target = create_target("string", guessed_name)
             claim = create_claim("P1972", target)
             item.addClaim(claim)
+            progress.record(qid, EDITED)
             counter += 1
         else:
             t.write(
                 "URLs not matching: {} - {}".format(normurl(website), normurl(repo_url))
             )
-
-        if oloho.cache_miss > 950:
-            t.write("Warning %s api-calls made. Exiting" % oloho.cache_miss)
-            break
+            progress.record(qid, NOMATCH)
 
 print("Added {} matches".format(counter))
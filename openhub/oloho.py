@@ -1,56 +1,291 @@
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import json
 import os
+import sys
+import threading
 import xml.etree.ElementTree as ET
 
 import requests
-from joblib import Memory
 
 queryapi = "projects.xml?query={}"
 mainapi = "p/{}.xml"
 enlistmentsapi = "p/{}/enlistments.xml"
+# All projects, oldest first, so that new projects are added at the end
+listapi = "projects.xml?sort=id&page={}"
+
+# Every API key may be used for this many calls a day
+dailyquota = 1000
+# Number of API calls made in parallel
+workers = 4
 
 session = requests.Session()
+session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+)
 
 # Set up cache so we don't query the oloho api every time
 abspath = os.path.abspath(__file__)
 dname = os.path.dirname(abspath)
 os.chdir(dname)
-directory = dname + "/oloho_cache"
-if not os.path.exists(directory):
-    os.makedirs(directory)
+sys.path.append(os.path.dirname(dname))
+from common.httpcache import CachedResponse, HTTPCache  # noqa: E402
 
-memory = Memory(cachedir=directory, verbose=0)
+# Open Hub data changes slowly, cached responses are revalidated after 30 days.
+# Projects that were not found are looked up again after a week, server
+# errors after an hour. The cache is kept below cachesize bytes.
+cachettl = 30 * 24 * 3600
+notfoundttl = 7 * 24 * 3600
+errorttl = 3600
+cachesize = 200 * 1024 * 1024
+cache = HTTPCache(
+    dname + "/oloho_cache.sqlite",
+    cachettl,
+    session,
+    notfoundttl=notfoundttl,
+    errorttl=errorttl,
+    maxsize=cachesize,
+)
 
 cache_miss = 0
+counterlock = threading.Lock()
+
+
+class APIError(LookupError):
+    """
+    The API answered with an error, the project may exist nevertheless.
+    """
+
+
+class KeyScheduler:
+    """
+    Spread the API calls over all API keys and keep track of the calls left
+    for every key today.
+
+    The calls made today are stored in `statefile`, so later runs on the same
+    day – also of other scripts – know what is left. The keys themselves are not
+    written to the file, only a hash.
+    """
+
+    def __init__(self, keys, quota, statefile):
+        self.keys = keys
+        self.quota = quota
+        self.statefile = statefile
+        self.lock = threading.Lock()
+        self.date = None
+        self.used = collections.Counter()
+        if os.path.exists(statefile):
+            with open(statefile) as f:
+                state = json.load(f)
+            self.date = state["date"]
+            self.used.update(state["used"])
+
+    @staticmethod
+    def keyid(key):
+        return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+    def newday(self):
+        today = datetime.datetime.utcnow().date().isoformat()
+        if self.date != today:
+            self.date = today
+            self.used.clear()
+
+    def save(self):
+        with self.lock:
+            with open(self.statefile + ".tmp", "w") as f:
+                json.dump({"date": self.date, "used": self.used}, f)
+            os.replace(self.statefile + ".tmp", self.statefile)
 
+    def remaining(self):
+        with self.lock:
+            self.newday()
+            return sum(
+                max(0, self.quota - self.used[self.keyid(key)]) for key in self.keys
+            )
 
-def use_key(num):
-    global oh_api_key
-    oh_api_key = open("mykey").readlines()[num][:-1]
+    def acquire(self):
+        """
+        Get the key with the most calls left and count a call for it.
+        """
+        with self.lock:
+            self.newday()
+            key = min(self.keys, key=lambda key: self.used[self.keyid(key)])
+            if self.used[self.keyid(key)] >= self.quota:
+                raise PermissionError("API Limit Exceeded for all keys")
+            self.used[self.keyid(key)] += 1
+            return key
 
+    def release(self, key):
+        """
+        Give back a call that was not made, because the answer was cached.
+        """
+        with self.lock:
+            self.used[self.keyid(key)] -= 1
 
-use_key(0)
+    def exhausted(self, key):
+        """
+        Mark a key as used up for today, because the API refused it.
+        """
+        with self.lock:
+            self.used[self.keyid(key)] = self.quota
+        self.save()
 
 
-@memory.cache
-def _getdata_(query, olohoname):
+def readkeys(filename="mykey"):
+    with open(filename) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+keys = KeyScheduler(readkeys(), dailyquota, dname + "/oloho_quota.json")
+pool = concurrent.futures.ThreadPoolExecutor(workers)
+
+
+def _getdata_(query, olohoname, parse=None, cached=True):
     global cache_miss
-    cache_miss += 1
-    url = "https://www.openhub.net/" + query.format(olohoname)
+    parse = parse or compact
+    key = "https://www.openhub.net/" + query.format(olohoname)
     if "?" in query:
-        url += "&api_key="
+        url = key + "&api_key="
     else:
-        url += "?api_key="
-    url += oh_api_key
-    r = session.get(url)
+        url = key + "?api_key="
+    # A key is only needed if the answer isn't cached
+    r = cache.fresh(key) if cached else None
+    while r is None:
+        api_key = keys.acquire()
+        if cached:
+            r = cache.get(url + api_key, key, parse=parse)
+        else:
+            response = session.get(url + api_key)
+            text = response.text
+            if response.status_code == 200:
+                text = parse(text)
+            r = CachedResponse(response.status_code, text, False)
+        if r.fromcache:
+            keys.release(api_key)
+        else:
+            keys.save()
+            with counterlock:
+                cache_miss += 1
+        if r.status_code == 401:
+            # This key is used up, try the next one
+            keys.exhausted(api_key)
+            r = None
     if r.status_code == 404:
         return None
-    elif r.status_code == 401:
-        raise PermissionError("API Limit Exceeded", r.status_code)
     elif r.status_code != 200:
-        raise LookupError("API-Error %s" % r.status_code)
+        raise APIError("API-Error %s" % r.status_code)
     return r.text
 
 
+def imap(func, iterable):
+    """
+    Call func for all elements on the worker pool and yield the elements and
+    the futures of the results in the original order.
+
+    Only a few calls are made ahead, so no quota is wasted if the caller stops
+    early. Exceptions are raised by future.result().
+    """
+    pending = collections.deque()
+    iterator = iter(iterable)
+    try:
+        for element in iterator:
+            pending.append((element, pool.submit(func, element)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+# The fields of a project the scripts use, by their path in the XML
+projectfields = {
+    "url_name": "url_name",
+    "name": "name",
+    "homepage_url": "homepage_url",
+    "main_language_name": "analysis/main_language_name",
+    "license": "licenses/license/name",
+}
+enlistmentfields = {"url": "code_location/url", "type": "code_location/type"}
+
+
+def readfields(elem, fields):
+    return {k: elem.findtext(v) for k, v in fields.items()}
+
+
+def parseevents(text, chunksize=64 * 1024):
+    """
+    Parse XML in chunks and yield the path and the element every time an
+    element ends – before the next chunk is parsed, so the caller can clear
+    the elements it has read.
+    """
+    parser = ET.XMLPullParser(["start", "end"])
+    path = []
+
+    def events():
+        for event, elem in parser.read_events():
+            if event == "start":
+                path.append(elem.tag)
+            else:
+                yield "/".join(path), elem
+                path.pop()
+
+    for start in range(0, len(text), chunksize):
+        parser.feed(text[start : start + chunksize])
+        yield from events()
+    parser.close()
+    yield from events()
+
+
+def extract(text):
+    """
+    Extract the used fields from an API response: the error message, the
+    first project and all enlistments.
+
+    The XML is parsed in chunks and every project and enlistment is cleared
+    once its fields are read, so the parsed tree of a large response stays
+    small.
+    """
+    record = {"error": None, "project": None, "enlistments": []}
+    for location, elem in parseevents(text):
+        if location == "response/error":
+            record["error"] = elem.text
+        elif location == "response/result/project":
+            if record["project"] is None:
+                record["project"] = readfields(elem, projectfields)
+            elem.clear()
+        elif location == "response/result/enlistment":
+            record["enlistments"].append(readfields(elem, enlistmentfields))
+            elem.clear()
+    return record
+
+
+def compact(text):
+    return json.dumps(extract(text), separators=(",", ":"))
+
+
+def extractlisting(text):
+    """
+    Extract the number of all projects and the used fields of the projects
+    from a page of the project list.
+    """
+    listing = {"available": 0, "projects": []}
+    for location, elem in parseevents(text):
+        if location == "response/items_available":
+            listing["available"] = int(elem.text)
+        elif location == "response/result/project":
+            listing["projects"].append(readfields(elem, projectfields))
+            elem.clear()
+    return listing
+
+
+def compactlisting(text):
+    return json.dumps(extractlisting(text), separators=(",", ":"))
+
+
 def getdata(query, olohoname):
     """
     Call the API and handle errors.
@@ -60,45 +295,47 @@ def getdata(query, olohoname):
     res = _getdata_(query, olohoname)
     if res is None:
         raise LookupError("Project not found")
+    elif res.startswith("<"):
+        # Cached before only the extracted fields were stored
+        return extract(res)
     else:
-        return ET.fromstring(res)
+        return json.loads(res)
 
 
 def getprojectdata(olohoname):
     """
     Get the main data about a project via the (cached) API.
     """
-    root = getdata(mainapi, olohoname)
-    error = root.findtext("error")
+    record = getdata(mainapi, olohoname)
+    error = record["error"]
     # The Oloho API returns no data at all if there is no analysis, even
     # through they might still have useful information, to bypass this
     # limitation, we use the query-api in these cases
     if error and error.startswith("No Analysis to display for"):
-        root = getdata(queryapi, olohoname)
-        project = root.find("result/project")
-        if project is not None and project.findtext("url_name") == olohoname:
+        project = getdata(queryapi, olohoname)["project"]
+        if project is not None and project["url_name"] == olohoname:
             return project
         else:
             raise LookupError("Project not found")
     else:
-        return root.find("result/project")
+        return record["project"]
 
 
 def findproject(guessedname, name):
     try:
-        root = getdata(mainapi, guessedname)
-        error = root.findtext("error")
+        record = getdata(mainapi, guessedname)
+        error = record["error"]
     except LookupError:
         error = True
     if error:
-        root = getdata(queryapi, name)
-        project = root.find("result/project")
-        if project and name in project.findtext("name"):  # TODO better heuristics
+        project = getdata(queryapi, name)["project"]
+        # TODO better heuristics
+        if project and name in (project["name"] or ""):
             return project
         else:
             raise LookupError("Project not found")
     else:
-        return root.find("result/project")
+        return record["project"]
 
 
 def getenlistments(olohoname):
@@ -106,7 +343,17 @@ def getenlistments(olohoname):
     Get the enlistments via the (cached) API.
     """
     try:
-        root = getdata(enlistmentsapi, olohoname)
-        return root.findall("result/enlistment")
+        return getdata(enlistmentsapi, olohoname)["enlistments"]
     except LookupError:
         return []
+
+
+def getlisting(page):
+    """
+    Get a page of the list of all projects via the API – not cached, the last
+    page grows when projects are added.
+    """
+    res = _getdata_(listapi, page, parse=compactlisting, cached=False)
+    if res is None:
+        raise LookupError("Page not found")
+    return json.loads(res)
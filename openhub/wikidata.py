@@ -1,10 +1,21 @@
 import code
 import datetime
+import os
+import queue
 import signal
-import urllib.parse
+import sys
+import threading
 
 import pywikibot
-import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import sparql  # noqa: E402
+from common.editqueue import (  # noqa: E402
+    Changeset,
+    EditQueue,
+    addqualifier,
+    addsources,
+)
 
 
 def debug_handler(signum, frame):
@@ -13,8 +24,6 @@ def debug_handler(signum, frame):
 
 signal.signal(signal.SIGUSR1, debug_handler)
 
-wdqurl = "https://query.wikidata.org/sparql?format=json&query="
-
 site = pywikibot.Site("wikidata", "wikidata")
 wikidata = site.data_repository()
 
@@ -22,43 +31,69 @@ _today = datetime.date.today()
 today = pywikibot.WbTime(year=_today.year, month=_today.month, day=_today.day)
 openhub = pywikibot.ItemPage(wikidata, "Q124688")
 
+# All changes to an item are saved in one edit, call flush() at the
+# end of a run
+editsfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "edits.jsonl")
+# Where changes go: to the edit queue, or to a changeset in plan mode – set by
+# edit() or plan()
+changes = None
+
 counter_added = 0
 counter_sourced = 0
 
 
 def runquery(query):
-    url = wdqurl + urllib.parse.quote_plus(query)
-    r = requests.get(url)
-    if r.status_code == 200:
-        return r.json()["results"]["bindings"]
-    else:
-        return None
-
-
-def get_mapping(prop):
-    query = (
-        """
-    SELECT DISTINCT ?object ?label WHERE
-    {
-      ?item wdt:%s ?object.
-      ?object rdfs:label|skos:altLabel ?label.
-      FILTER (lang(?label) = "en")
-    }
     """
-        % prop
-    )
-    results = runquery(query)
-    bad = []
-    mapping = {}
-    for l in results:
-        key = l["label"]["value"].lower()
-        if key in mapping:
-            del mapping[key]
-            bad.append(key)
-        elif key not in bad:
-            mapping[key] = l["object"]["value"][31:]
-    del bad
-    return mapping
+    Run a SPARQL query, the bindings are yielded while they arrive.
+    """
+    return sparql.bindings(query)
+
+
+def preloaditems(rows, groupsize=50):
+    """
+    Yield the rows of a query result (with the variable ?item) together with
+    their items.
+
+    The items are loaded in a background thread ahead of the caller, with one
+    wbgetentities request for up to groupsize items.
+    """
+    batches = queue.Queue(maxsize=2)
+    end = object()
+
+    def load():
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == groupsize:
+                    batches.put(loadbatch(batch))
+                    batch = []
+            if batch:
+                batches.put(loadbatch(batch))
+            batches.put(end)
+        except Exception as e:
+            batches.put(e)
+
+    def loadbatch(batch):
+        pages = [
+            pywikibot.ItemPage(wikidata, row["item"]["value"][31:]) for row in batch
+        ]
+        loaded = {
+            page.getID(): page for page in wikidata.preload_entities(pages, groupsize)
+        }
+        # Items missing in the response are loaded on item.get()
+        return [
+            (row, loaded.get(page.getID(), page)) for row, page in zip(batch, pages)
+        ]
+
+    threading.Thread(target=load, daemon=True).start()
+    while True:
+        batch = batches.get()
+        if batch is end:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield from batch
 
 
 def createsource(url_str, title_str, name=None):
@@ -103,10 +138,16 @@ def create_andor_source(item, prop, target, qualifier, source, logger=print):
     source_summary = "Adding Open-Hub as source"
     if prop not in item.claims:
         claim = create_claim(prop, target)
-        item.addClaim(claim)
         if qualifier is not None:
-            claim.addQualifier(qualifier)
-        claim.addSources(source, summary=source_summary)
+            addqualifier(claim, qualifier)
+        addsources(claim, source)
+        changes.addclaim(
+            item.getID(),
+            claim,
+            "Adding claims with Open-Hub as source",
+            item.latest_revision_id,
+        )
+        item.claims.setdefault(prop, []).append(claim)
         counter_added += 1
         logger("  Successfully added")
     else:
@@ -114,10 +155,36 @@ def create_andor_source(item, prop, target, qualifier, source, logger=print):
             if claim.getTarget() == target and not search_sources(
                 claim.sources, "openhub"
             ):
-                claim.addSources(source, summary=source_summary)
+                addsources(claim, source)
+                changes.addclaim(
+                    item.getID(), claim, source_summary, item.latest_revision_id
+                )
                 counter_sourced += 1
                 logger("  Successfully sourced")
 
 
+def edit():
+    """
+    Send all changes to Wikidata, with an edit queue – which is returned.
+    """
+    global changes
+    changes = EditQueue(wikidata, editsfile)
+    return changes
+
+
+def plan(filename):
+    """
+    Write all changes to a changeset file instead of editing – see
+    common.editqueue.apply(). The changes carry the revision of their item,
+    so applying them later fails for items edited in the meantime.
+    """
+    global changes
+    changes = Changeset(filename)
+
+
+def flush():
+    changes.flush()
+
+
 def get_counters():
     return (counter_added, counter_sourced)